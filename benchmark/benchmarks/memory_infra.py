@@ -5,6 +5,8 @@ from telemetry.timeline import tracing_category_filter
 from telemetry.web_perf import timeline_based_measurement
 from telemetry.web_perf.metrics import memory_timeline
 
+from benchmark.page_sets.url_manifest import load_url_manifest
+
 
 class _MemoryInfraBenchmark(benchmark.Benchmark):
     def CustomizeBrowserOptions(self, options):
@@ -17,6 +19,12 @@ class _MemoryInfraBenchmark(benchmark.Benchmark):
             '--enable-heap-profiling',
         ])
 
+    def CreateStorySet(self, options):
+        manifest = getattr(options, 'url_manifest', None)
+        if not manifest:
+            return super(_MemoryInfraBenchmark, self).CreateStorySet(options)
+        return self.page_set(urls=load_url_manifest(manifest))
+
     def CreateTimelineBasedMeasurementOptions(self):
         trace_memory = tracing_category_filter.TracingCategoryFilter(
             filter_string='-*,blink.console,disabled-by-default-memory-infra')
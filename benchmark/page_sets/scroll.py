@@ -24,21 +24,22 @@ class ScrollPageBase(page_module.Page):
         self._DumpMemory(action_runner, 'scrolled')
 
 
+_DEFAULT_URLS = [
+    ('http://www.theverge.com', 'TheVerge'),
+    # ('http://mobile.nytimes.com/', 'NewYorkTimes'),
+    # ('http://www.reddit.com/r/programming/comments/1g96ve', 'Reddit'),
+    # ('http://en.m.wikipedia.org/wiki/Wikipedia', 'Wikipedia'),
+]
+
+
 class ScrollPageSetBase(story.StorySet):
     def __init__(self, archive_data_file,
-                 page_set_class, shared_page_state_class):
+                 page_set_class, shared_page_state_class, urls=None):
         super(ScrollPageSetBase, self).__init__(
             archive_data_file=archive_data_file,
             cloud_storage_bucket=story.PARTNER_BUCKET)
 
-        urls = [
-            ('http://www.theverge.com', 'TheVerge'),
-            # ('http://mobile.nytimes.com/', 'NewYorkTimes'),
-            # ('http://www.reddit.com/r/programming/comments/1g96ve', 'Reddit'),
-            # ('http://en.m.wikipedia.org/wiki/Wikipedia', 'Wikipedia'),
-        ]
-
-        for url in urls:
+        for url in urls or _DEFAULT_URLS:
             self.AddStory(page_set_class(
                 url=url[0],
                 page_set=self,
@@ -56,11 +57,12 @@ class ScrollDesktopPage(ScrollPageBase):
 
 
 class BlinkDesktopPageSet(ScrollPageSetBase):
-    def __init__(self):
+    def __init__(self, urls=None):
         super(BlinkDesktopPageSet, self).__init__(
             archive_data_file='data/blink_memory_desktop.json',
             page_set_class=ScrollDesktopPage,
-            shared_page_state_class=shared_page_state.SharedDesktopPageState)
+            shared_page_state_class=shared_page_state.SharedDesktopPageState,
+            urls=urls)
 
 
 # Mobile
@@ -74,8 +76,9 @@ class ScrollMobilePage(ScrollPageBase):
 
 
 class BlinkMobilePageSet(ScrollPageSetBase):
-    def __init__(self):
+    def __init__(self, urls=None):
         super(BlinkMobilePageSet, self).__init__(
             archive_data_file='data/blink_memory_mobile.json',
             page_set_class=ScrollMobilePage,
-            shared_page_state_class=shared_page_state.SharedMobilePageState)
+            shared_page_state_class=shared_page_state.SharedMobilePageState,
+            urls=urls)
@@ -0,0 +1,21 @@
+"""Reads page set URLs from a manifest file.
+
+Each line is a URL optionally followed by whitespace and a story name.
+Empty lines and lines starting with '#' are ignored. Stories without a
+name are named after their URL.
+"""
+
+
+def load_url_manifest(path):
+    """Returns a list of (url, name) tuples."""
+    urls = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = line.split(None, 1)
+            url = fields[0]
+            name = fields[1] if len(fields) > 1 else url
+            urls.append((url, name))
+    return urls
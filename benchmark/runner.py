@@ -1,7 +1,16 @@
+import json
+import logging
+import multiprocessing
 import os
+import time
 
 from util import insert_catapult_path
 from util import get_chromium_path
+from util.convert_benchmark_outputs import convert_file
+from util.read_trace import read_trace
+from util.trace_events import split_trace
+from benchmark import sharding
+from peak_resident_sizes import extract_peak_resident_sizes
 
 from telemetry import benchmark_runner
 from telemetry import project_config
@@ -10,17 +19,24 @@ from telemetry.internal.results import results_options
 from telemetry.internal.util import command_line
 
 
-_CHROMIUM_CLIENT_CONFIG_PATH = os.path.join(
-    get_chromium_path(), 'tools', 'perf', 'chrome_telemetry_build',
-    'binary_dependencies.json')
 _BENCHMARK_DIR = os.path.join(
     os.path.dirname(os.path.abspath(__file__)), 'benchmarks')
+_STORY_DURATIONS_FILE = 'story_durations.json'
+
+
+def _chromium_client_config_path():
+    return os.path.join(
+        get_chromium_path(), 'tools', 'perf', 'chrome_telemetry_build',
+        'binary_dependencies.json')
 
 
 class MyConfig(project_config.ProjectConfig):
     def __init__(self, top_level_dir=None, benchmark_dirs=None,
-                 client_config=_CHROMIUM_CLIENT_CONFIG_PATH,
-                 default_chrome_root=get_chromium_path()):
+                 client_config=None, default_chrome_root=None):
+        if not client_config:
+            client_config = _chromium_client_config_path()
+        if not default_chrome_root:
+            default_chrome_root = get_chromium_path()
         if not top_level_dir:
             current_path = os.path.join(os.path.dirname(__file__), '..')
             top_level_dir = os.path.abspath(current_path)
@@ -32,23 +48,175 @@ class MyConfig(project_config.ProjectConfig):
             default_chrome_root=default_chrome_root)
 
 
+def _post_process_trace(html):
+    """Converts a serialized trace to .json.gz and writes its peak
+    resident sizes next to it. Runs in a worker process."""
+    # Parse the trace once for both.
+    trace = read_trace(html)
+    output = convert_file(html, output_format='gzip', trace=trace)
+    events, _ = split_trace(trace)
+    result = extract_peak_resident_sizes(events)
+    peaks_path = os.path.splitext(html)[0] + '.peaks.json'
+    with open(peaks_path, 'w') as f:
+        json.dump(result, f)
+    return output, peaks_path
+
+
+class _TracePostProcessor(object):
+    """Serializes the traces of each story as soon as it has run and
+    post-processes them in worker processes while the next story runs.
+
+    Hooks results.DidRunPage() since story_runner.Run() has no per-story
+    callback.
+    """
+
+    def __init__(self, results, jobs):
+        self._results = results
+        self._serialized = set()
+        self._pending = []
+        self._pool = multiprocessing.Pool(jobs)
+        did_run_page = results.DidRunPage
+
+        def hooked_did_run_page(*args, **kwargs):
+            did_run_page(*args, **kwargs)
+            self._serialize_new_traces()
+        results.DidRunPage = hooked_did_run_page
+
+    def _serialize_new_traces(self):
+        results = self._results
+        for value in results.FindAllTraceValues():
+            if id(value) in self._serialized:
+                continue
+            self._serialized.add(id(value))
+            fh = value.Serialize(results._output_dir)
+            path = fh.GetAbsPath()
+            results._serialized_trace_file_ids_to_paths[fh.id] = path
+            self._pending.append(
+                (path, self._pool.apply_async(_post_process_trace, (path,))))
+
+    def finish(self):
+        """Serializes remaining traces and waits for the workers. Returns
+        (json.gz path, peaks path) of each post-processed trace.
+
+        A trace which fails to post-process is logged and skipped, since
+        the run itself has succeeded.
+        """
+        try:
+            self._serialize_new_traces()
+        finally:
+            self._pool.close()
+            self._pool.join()
+        outputs = []
+        for path, pending in self._pending:
+            try:
+                outputs.append(pending.get())
+            except Exception:
+                logging.exception('Failed to post-process %s', path)
+        return outputs
+
+    def abort(self):
+        """Stops the workers without waiting for pending traces."""
+        self._pool.terminate()
+        self._pool.join()
+
+
+class _StoryTimer(object):
+    """Measures how long each story takes, for balancing shards of later
+    runs. Hooks results.WillRunPage() and results.DidRunPage()."""
+
+    def __init__(self, results):
+        self._results = results
+        self._start = None
+        # story name -> list of seconds
+        self.durations = {}
+        will_run_page = results.WillRunPage
+        did_run_page = results.DidRunPage
+
+        def hooked_will_run_page(*args, **kwargs):
+            self._start = time.time()
+            will_run_page(*args, **kwargs)
+
+        def hooked_did_run_page(story, *args, **kwargs):
+            did_run_page(story, *args, **kwargs)
+            self.durations.setdefault(story.display_name, []).append(
+                time.time() - self._start)
+        results.WillRunPage = hooked_will_run_page
+        results.DidRunPage = hooked_did_run_page
+
+    def write(self, path):
+        """Writes the average duration of each story to |path|."""
+        with open(path, 'w') as f:
+            json.dump({name: sum(durations) / len(durations)
+                       for name, durations in self.durations.iteritems()},
+                      f, indent=2, sort_keys=True)
+
+
+def _shard_stories(stories, finder_options):
+    shard_count = getattr(finder_options, 'shard_count', 1)
+    if shard_count <= 1:
+        return stories
+    durations = sharding.load_durations(
+        getattr(finder_options, 'story_durations', None) or [])
+    return sharding.shard_story_set(stories, finder_options.shard_index,
+                                    shard_count, durations)
+
+
 # Partially copied from telemetry.telemetry.internal.story_runner.RunBenchmark
 def run_benchmark(benchmark, finder_options):
     benchmark.CustomizeBrowserOptions(finder_options.browser_options)
     pt = benchmark.CreatePageTest(finder_options)
     pt.__name__ = benchmark.__class__.__name__
-    stories = benchmark.CreateStorySet(finder_options)
+    stories = _shard_stories(benchmark.CreateStorySet(finder_options),
+                             finder_options)
     benchmark_metadata = benchmark.GetMetadata()
     with results_options.CreateResults(
             benchmark_metadata, finder_options,
             benchmark.ValueCanBeAddedPredicate) as results:
-        failures = story_runner.Run(pt, stories, finder_options, results,
-                                    benchmark.max_failures)
-        results._SerializeTracesToDirPath(results._output_dir)
+        timer = _StoryTimer(results)
+        jobs = getattr(finder_options, 'post_process_jobs', 0)
+        post_processor = (_TracePostProcessor(results, jobs) if jobs > 0
+                          else None)
+        try:
+            try:
+                failures = story_runner.Run(pt, stories, finder_options,
+                                            results, benchmark.max_failures)
+            except:
+                # Don't let errors of pending traces mask this one.
+                if post_processor:
+                    post_processor.abort()
+                raise
+            if post_processor:
+                post_processor.finish()
+            else:
+                results._SerializeTracesToDirPath(results._output_dir)
+        finally:
+            # Durations of the stories which ran still balance later shards.
+            timer.write(os.path.join(results._output_dir,
+                                     _STORY_DURATIONS_FILE))
     return failures
 
 
 class RecordTrace(benchmark_runner.Run):
+    @classmethod
+    def AddCommandLineArgs(cls, parser, environment):
+        super(RecordTrace, cls).AddCommandLineArgs(parser, environment)
+        parser.add_option('--post-process-jobs', type='int', default=2,
+                          help='Number of worker processes which convert '
+                          'and summarize each trace while the next story '
+                          'runs. 0 disables post-processing.')
+        parser.add_option('--url-manifest',
+                          help='File with one URL (and optionally a story '
+                          'name) per line to use instead of the built-in '
+                          'page set URLs.')
+        parser.add_option('--shard-count', type='int', default=1,
+                          help='Number of shards the stories are split into.')
+        parser.add_option('--shard-index', type='int', default=0,
+                          help='Which shard to run, from 0.')
+        parser.add_option('--story-durations', action='append',
+                          help='%s of earlier runs, used to balance the '
+                          'shards. Can be given multiple times.'
+                          % _STORY_DURATIONS_FILE)
+
     def Run(self, args):
         return run_benchmark(self._benchmark(), args)
 
@@ -0,0 +1,64 @@
+"""Splits a story set into shards which take about the same time.
+
+Stories are assigned longest first to the shard with the least total
+duration so far, using the story_durations.json files written by earlier
+record_trace runs. Stories without a measurement are assumed to take the
+average measured duration. The assignment only depends on the story names
+and durations, so every shard computes the same split.
+"""
+
+import json
+
+
+_DEFAULT_DURATION = 1.0
+
+
+def load_durations(paths):
+    """Reads {story name: seconds} files and averages repeated names."""
+    totals = {}
+    for path in paths:
+        with open(path) as f:
+            for name, duration in json.load(f).iteritems():
+                total = totals.setdefault(name, [0.0, 0])
+                total[0] += duration
+                total[1] += 1
+    return {name: total / count
+            for name, (total, count) in totals.iteritems()}
+
+
+def assign_shards(names, shard_count, durations=None):
+    """Returns a list of |shard_count| lists of |names|."""
+    durations = durations or {}
+    known = [durations[name] for name in names if name in durations]
+    default = sum(known) / len(known) if known else _DEFAULT_DURATION
+    # Sort by name too so that ties are broken the same way everywhere.
+    ordered = sorted(names, key=lambda name: (-durations.get(name, default),
+                                              name))
+    shards = [[] for _ in range(shard_count)]
+    loads = [0.0] * shard_count
+    for name in ordered:
+        shard = loads.index(min(loads))
+        shards[shard].append(name)
+        loads[shard] += durations.get(name, default)
+    return shards
+
+
+def shard_story_set(story_set, shard_index, shard_count, durations=None):
+    """Removes the stories not in shard |shard_index| from |story_set|.
+
+    The remaining stories are reordered longest first.
+    """
+    if not 0 <= shard_index < shard_count:
+        raise ValueError('Shard index %d out of range [0, %d)' % (
+            shard_index, shard_count))
+    stories = list(story_set.stories)
+    names = [story.display_name for story in stories]
+    if len(set(names)) != len(names):
+        raise ValueError('Story names must be unique to shard')
+    shard = assign_shards(names, shard_count, durations)[shard_index]
+    by_name = dict(zip(names, stories))
+    for story in stories:
+        story_set.RemoveStory(story)
+    for name in shard:
+        story_set.AddStory(by_name[name])
+    return story_set
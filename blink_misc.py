@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+"""Single entry point for the analysis tools in this repository.
+
+Usage:
+  $ python blink_misc.py <command> [args...]
+  $ python blink_misc.py <command> --help
+
+Each command's module is imported only when the command runs, so the
+analysis commands start quickly and don't need a Chromium checkout.
+Only idl-to-json needs one (for the Blink IDL parser).
+"""
+
+import os
+import sys
+
+
+_ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# command -> (directory relative to the root, module name, description)
+_COMMANDS = [
+    ('read-trace', ('', 'util.read_trace',
+                    'Print a trace (.json, .json.gz or .html) as JSON.')),
+    ('convert', ('', 'util.convert_benchmark_outputs',
+                 'Convert telemetry HTML results in a directory to JSON.')),
+    ('peaks', ('', 'peak_resident_sizes',
+               'Summarize peak resident sizes of renderers.')),
+    ('report', ('outdated', 'report_telemetory_traces',
+                'Report allocator sizes of telemetry results.')),
+    ('idl-to-json', (os.path.join('diff', 'scripts'), 'definitions_to_json',
+                     'Dump IDL definitions as JSON.')),
+]
+
+
+def _usage():
+    lines = ['usage: %s <command> [args...]' % os.path.basename(sys.argv[0]),
+             '', 'commands:']
+    for name, (_, _, description) in _COMMANDS:
+        lines.append('  %-12s %s' % (name, description))
+    return '\n'.join(lines)
+
+
+def _import_command(directory, module_name):
+    path = os.path.join(_ROOT_DIR, directory)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+    __import__(module_name)
+    return sys.modules[module_name]
+
+
+def main(args):
+    commands = dict(_COMMANDS)
+    if not args or args[0] not in commands:
+        sys.stderr.write(_usage() + '\n')
+        return 2
+    directory, module_name, _ = commands[args[0]]
+    # Commands parse sys.argv[0] for their usage messages.
+    sys.argv[0] = '%s %s' % (os.path.basename(sys.argv[0]), args[0])
+    return _import_command(directory, module_name).main(args[1:])
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,86 @@
+"""Finds significant changes between two sets of benchmark results.
+
+Each set is a list of peak_resident_sizes mapping results or telemetry
+results.json files. Samples are grouped per label (mapping results) or
+per page and value name (results.json), and every metric is tested with
+a Mann-Whitney U test and a bootstrap confidence interval.
+
+Usage:
+  $ python compare_results.py --before a1.json a2.json --after b1.json
+"""
+
+import argparse
+import json
+import sys
+
+from peak_resident_sizes import _PEAK_VALUE_NAME
+from util.significance import compare
+
+
+def _add_mapping_result(results, samples):
+    for value in results['values']:
+        if value.get('name') != _PEAK_VALUE_NAME:
+            continue
+        for peak in value['value'].itervalues():
+            samples.setdefault(peak['label'], []).append(peak['size'])
+
+
+def _add_telemetry_results(results, samples):
+    pages = {page['id']: page['name']
+             for page in results['pages'].itervalues()}
+    for value in results['per_page_values']:
+        if value['type'] != 'scalar' or value.get('values') is None:
+            continue
+        page = pages.get(value['page_id'], '<unknown>')
+        metric = '%s/%s' % (page, value['name'])
+        samples.setdefault(metric, []).extend(value['values'])
+
+
+def load_samples(paths):
+    """Returns {metric: [samples]} of the results in |paths|."""
+    samples = {}
+    for path in paths:
+        with open(path) as f:
+            results = json.load(f)
+        if 'per_page_values' in results:
+            _add_telemetry_results(results, samples)
+        else:
+            _add_mapping_result(results, samples)
+    return samples
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--before', nargs='+', required=True)
+    parser.add_argument('--after', nargs='+', required=True)
+    parser.add_argument('-a', '--alpha', type=float, default=0.05,
+                        help='False discovery rate.')
+    parser.add_argument('--confidence', type=float, default=0.95,
+                        help='Confidence level of the intervals.')
+    parser.add_argument('--all', dest='show_all', action='store_true',
+                        help='Show metrics without significant changes too.')
+    return parser.parse_args(args)
+
+
+def main(args):
+    opts = parse_args(args)
+    results = compare(load_samples(opts.before), load_samples(opts.after),
+                      alpha=opts.alpha, confidence=opts.confidence)
+    for result in results:
+        if not (result['significant'] or opts.show_all):
+            continue
+        print('[%s]%s\n%.2f -> %.2f (%+.2f%%), diff %.2f [%.2f, %.2f], '
+              'p=%.3g' % (
+            result['metric'].encode('utf-8'),
+            ' *' if result['significant'] else '',
+            result['before_mean'] / 1024**2,
+            result['after_mean'] / 1024**2,
+            result['difference'] / (result['before_mean'] or 1) * 100,
+            result['difference'] / 1024**2,
+            result['ci_low'] / 1024**2,
+            result['ci_high'] / 1024**2,
+            result['p_value']))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
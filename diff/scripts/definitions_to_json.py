@@ -7,8 +7,10 @@ TODOs:
 
 """
 
+import argparse
 from collections import defaultdict
 import json
+import multiprocessing
 import os
 import subprocess
 import sys
@@ -16,18 +18,74 @@ import sys
 import insert_crpath
 
 from blink_idl_parser import BlinkIDLParser
-from idl_definitions import IdlDefinitions, Visitor
+from idl_definitions import IdlDefinitions
 import idl_types
 
+from idl_cache import DEFAULT_CACHE_DIR, IdlCache, digest
+from idl_preprocessor import UnsupportedDirective, preprocess
 from old_webkit_idl_parser import WebKitIDLParser
 
 
+_DEFINITIONS_NAMESPACE = 'definitions'
+
+# Modules whose changes (e.g. by a Chromium sync) invalidate cached
+# definitions.
+_PARSER_MODULES = ['blink_idl_lexer', 'blink_idl_parser', 'idl_definitions',
+                   'idl_types', 'old_webkit_idl_parser']
+
+
+def _json_default(obj):
+    if issubclass(type(obj), idl_types.IdlSequenceType):
+        return {
+            'base_type': str(obj),
+        }
+    elif issubclass(type(obj), idl_types.IdlArrayType):
+        return {
+            'base_type': str(obj),
+        }
+    elif issubclass(type(obj), idl_types.IdlUnionType):
+        return {
+            'base_type': str(obj),
+        }
+    elif issubclass(type(obj), idl_types.IdlNullableType):
+        return {
+            'base_type': str(obj),
+        }
+    return obj.__dict__
+
+
+def _to_plain(obj):
+    """Returns |obj| as the dicts, lists and scalars it is dumped as.
+
+    Unlike the parser's objects (IdlTypeBase answers None for any missing
+    attribute, including pickle's hooks), the result can be pickled.
+    """
+    if isinstance(obj, dict):
+        return {key: _to_plain(value) for key, value in obj.iteritems()}
+    if isinstance(obj, (list, tuple)):
+        return [_to_plain(value) for value in obj]
+    if obj is None or isinstance(obj, (basestring, int, long, float)):
+        return obj
+    return _to_plain(_json_default(obj))
+
+
+def _parser_version():
+    sources = []
+    for name in _PARSER_MODULES:
+        filename = os.path.splitext(sys.modules[name].__file__)[0] + '.py'
+        with open(filename) as f:
+            sources.append(f.read())
+    return digest('\0'.join(sources))
+
+
 class ConverterBase(object):
     """Parse IDL files, convert into a JSON object, merging implements/partial.
     """
 
-    def __init__(self, parser):
+    def __init__(self, parser, cache=None):
         self._parser = parser
+        self._cache = cache
+        self._cache_tag = None
         self._partial_interfaces = {}
         self._implements = defaultdict(list)
         self._interfaces = {}
@@ -42,7 +100,14 @@ class ConverterBase(object):
     def _post_process(self, interfaces):
         return interfaces
 
-    def process_idl_file(self, path):
+    def parse_idl_file(self, path):
+        """Parses |path| without touching the state of the converter.
+
+        Returns a picklable dict of the file's interfaces and partial
+        interfaces (as plain dicts in their JSON form), (left, right)
+        implements pairs and renamed interfaces, which can be passed to
+        add_parsed_file().
+        """
         content = self._read_idl_content(path)
         idl_nodes = self._parser.ParseText(path, content)
         if self._parser.GetErrors() > 0:
@@ -50,40 +115,106 @@ class ConverterBase(object):
         idl_name, _ = os.path.splitext(os.path.basename(path))
         definitions = IdlDefinitions(idl_name, idl_nodes)
         definitions = self._rewrite_definitions(definitions)
+        return {
+            'interfaces': {
+                interface.name: _to_plain(interface)
+                for interface in definitions.interfaces.itervalues()
+                if not interface.is_partial},
+            'partial_interfaces': {
+                interface.name: _to_plain(interface)
+                for interface in definitions.interfaces.itervalues()
+                if interface.is_partial},
+            'implements': [(impl.left_interface, impl.right_interface)
+                           for impl in definitions.implements],
+            # Interfaces renamed by _rewrite_definitions(); definitions are
+            # keyed by their names in the IDL.
+            'interface_names': {
+                name: interface.name
+                for name, interface in definitions.interfaces.iteritems()
+                if name != interface.name},
+        }
+
+    def add_parsed_file(self, parsed):
+        self._interfaces.update(parsed['interfaces'])
+        self._partial_interfaces.update(parsed['partial_interfaces'])
+        for left, right in parsed['implements']:
+            self._implements[left].append(right)
+
+    def _definitions_cache_tag(self):
+        return type(self).__name__
+
+    def _definitions_cache_entry(self, path):
+        """Returns (key, content digest) of the cached definitions of
+        |path|. Entries are per path, so an edited file overwrites its
+        stale entry."""
+        if self._cache_tag is None:
+            self._cache_tag = '%s:%s' % (self._definitions_cache_tag(),
+                                         _parser_version())
+        with open(path, 'rb') as f:
+            content_digest = digest(f.read())
+        return (digest('%s:%s' % (self._cache_tag, os.path.abspath(path))),
+                content_digest)
+
+    def _store(self, namespace, key, value, description):
+        # The cache only saves time; a failure to write an entry (a full
+        # disk, an unpicklable value) leaves it uncached.
+        try:
+            self._cache.put(namespace, key, value)
+        except Exception as e:
+            sys.stderr.write('Warning: Failed to cache %s: %s\n' % (
+                description, e))
+
+    def load_parsed_file(self, path):
+        """Returns the cached parse_idl_file() result of |path|, or None if
+        it isn't cached or |path| has changed since."""
+        if not self._cache:
+            return None
+        key, content_digest = self._definitions_cache_entry(path)
+        entry = self._cache.get(_DEFINITIONS_NAMESPACE, key)
+        if entry is None or entry[0] != content_digest:
+            return None
+        return entry[1]
+
+    def parse_and_store_idl_file(self, path):
+        """Like parse_idl_file(), but also caches the result."""
+        if not self._cache:
+            return self.parse_idl_file(path)
+        # Hash before parsing so that a file edited meanwhile is parsed
+        # again next time.
+        key, content_digest = self._definitions_cache_entry(path)
+        parsed = self.parse_idl_file(path)
+        self._store(_DEFINITIONS_NAMESPACE, key, (content_digest, parsed),
+                    'definitions of %s' % path)
+        return parsed
 
-        self._interfaces.update({
-            interface.name: interface
-            for interface in definitions.interfaces.itervalues()
-            if not interface.is_partial})
-        self._partial_interfaces.update({
-            interface.name: interface
-            for interface in definitions.interfaces.itervalues()
-            if interface.is_partial})
-        for impl in definitions.implements:
-            self._implements[impl.left_interface].append(impl.right_interface)
+    def process_idl_file(self, path):
+        parsed = self.load_parsed_file(path)
+        if parsed is None:
+            parsed = self.parse_and_store_idl_file(path)
+        self.add_parsed_file(parsed)
 
     def _merge_interface(self, dest, src):
         # TODO(bashi): Maybe merge setlike and maplike
-        dest.attributes.extend(src.attributes)
-        dest.constants.extend(src.constants)
-        dest.operations.extend(src.operations)
-        
+        dest['attributes'].extend(src['attributes'])
+        dest['constants'].extend(src['constants'])
+        dest['operations'].extend(src['operations'])
+
     def _merge_implements(self, interface):
-        for impl_name in self._implements[interface.name]:
+        for impl_name in self._implements[interface['name']]:
             impl_interface = self._interfaces.get(impl_name)
             if not impl_interface:
                 sys.stderr.write(
                     'Warning: %s implements %s, but cannot find %s\n' % (
-                    interface.name, impl_name, impl_name))
+                    interface['name'], impl_name, impl_name))
                 continue
             self._merge_interface(interface, impl_interface)
 
     def _merge_partial(self, partial_interface):
-        interface = self._interfaces.get(partial_interface.name)
+        interface = self._interfaces.get(partial_interface['name'])
         if not interface:
             sys.stderr.write(
                 'Warning: Partial interface %s is found but no original '
-                'definition found. Ignore it.\n' % partial_interface.name)
+                'definition found. Ignore it.\n' % partial_interface['name'])
             return
         self._merge_interface(interface, partial_interface)
 
@@ -97,56 +228,76 @@ class ConverterBase(object):
     def to_json(self):
         interfaces = self._merge()
         interfaces = self._post_process(interfaces)
-        def _default(obj):
-            if issubclass(type(obj), idl_types.IdlSequenceType):
-                return {
-                    'base_type': str(obj),
-                }
-            elif issubclass(type(obj), idl_types.IdlArrayType):
-                return {
-                    'base_type': str(obj),
-                }
-            elif issubclass(type(obj), idl_types.IdlUnionType):
-                return {
-                    'base_type': str(obj),
-                }
-            elif issubclass(type(obj), idl_types.IdlNullableType):
-                return {
-                    'base_type': str(obj),
-                }
-            return obj.__dict__
-        return json.dumps(interfaces, indent=2,
-                          default=_default, sort_keys=True)
+        return json.dumps(interfaces, indent=2, sort_keys=True)
 
 
 class BlinkConverter(ConverterBase):
-    def __init__(self):
-        super(BlinkConverter, self).__init__(BlinkIDLParser())
+    def __init__(self, cache=None, use_gcc=False):
+        super(BlinkConverter, self).__init__(BlinkIDLParser(), cache)
 
 
-class NameRewriteVisitor(Visitor):
+class NameRewriter(object):
+    """Renames the types of the members of plain interface dicts, as
+    idl_definitions.Visitor visits the typed objects of an interface."""
+
+    _MEMBERS = ['attributes', 'constants', 'constructors',
+                'custom_constructors', 'operations']
+
     def __init__(self, name_map):
         self._name_map = name_map
 
     def rewrite(self, interface):
-        interface.accept(self)
-
-    def visit_typed_object(self, typed_object):
-        if not typed_object.idl_type:
+        for member in self._MEMBERS:
+            for typed_object in interface.get(member) or []:
+                self._rewrite_typed_object(typed_object)
+                for argument in typed_object.get('arguments') or []:
+                    self._rewrite_typed_object(argument)
+
+    def _rewrite_typed_object(self, typed_object):
+        idl_type = typed_object.get('idl_type')
+        if not idl_type:
             return
-        original = typed_object.idl_type.base_type
-        typed_object.idl_type.base_type = self._name_map.get(original, original)
+        original = idl_type.get('base_type')
+        if original in self._name_map:
+            idl_type['base_type'] = self._name_map[original]
 
 
 class WebKitConverter(ConverterBase):
-    def __init__(self):
-        super(WebKitConverter, self).__init__(WebKitIDLParser())
+    _PREPROCESSED_NAMESPACE = 'preprocessed'
+
+    def __init__(self, cache=None, use_gcc=False):
+        super(WebKitConverter, self).__init__(WebKitIDLParser(), cache)
+        self._use_gcc = use_gcc
         self._interface_name_map = {}
 
     def _read_idl_content(self, path):
-        # WebKit IDLs could have some macros. Remove them.
+        # WebKit IDLs could have some macros. Remove them, without spawning
+        # gcc unless the IDL uses more than conditionals.
+        content = super(WebKitConverter, self)._read_idl_content(path)
+        if not self._use_gcc:
+            try:
+                return preprocess(content)
+            except UnsupportedDirective:
+                pass
+        return self._run_gcc(path, content)
+
+    def _definitions_cache_tag(self):
+        # gcc and the Python preprocessor differ in whitespace only, but
+        # don't mix them anyway.
+        return '%s:%s' % (type(self).__name__,
+                          'gcc' if self._use_gcc else 'python')
+
+    def _run_gcc(self, path, content):
+        key = digest(content)
+        if self._cache:
+            preprocessed = self._cache.get(self._PREPROCESSED_NAMESPACE, key)
+            if preprocessed is not None:
+                return preprocessed
         preprocessed = subprocess.check_output([
             'gcc', '-E', '-P', '-x', 'c++', path])
+        if self._cache:
+            self._store(self._PREPROCESSED_NAMESPACE, key, preprocessed,
+                        'preprocessed %s' % path)
         return preprocessed
 
     def _rewrite_definitions(self, definitions):
@@ -157,11 +308,14 @@ class WebKitConverter(ConverterBase):
     def _rewrite_interface(self, interface):
         interface_name = interface.extended_attributes.get('InterfaceName')
         if interface_name:
-            self._interface_name_map[interface.name] = interface_name
             interface.name = interface_name
 
+    def add_parsed_file(self, parsed):
+        super(WebKitConverter, self).add_parsed_file(parsed)
+        self._interface_name_map.update(parsed['interface_names'])
+
     def _post_process(self, interfaces):
-        name_rewriter = NameRewriteVisitor(self._interface_name_map)
+        name_rewriter = NameRewriter(self._interface_name_map)
         for interface in interfaces.itervalues():
             name_rewriter.rewrite(interface)
         return interfaces
@@ -192,22 +346,79 @@ def target_files(path):
     return all_idl_files(path)
 
 
-def _create_converter(path):
+def _create_converter(path, cache=None, use_gcc=False):
     # Assumes that if the absolute path contains 'WebCore', it's WebKit.
     if 'WebCore' in os.path.abspath(path):
-        return WebKitConverter()
-    return BlinkConverter()
+        return WebKitConverter(cache, use_gcc)
+    return BlinkConverter(cache, use_gcc)
+
+
+# Converter of the current worker process; each worker has its own parser.
+_worker_converter = None
+
 
+def _init_worker(path, cache, use_gcc):
+    global _worker_converter
+    _worker_converter = _create_converter(path, cache, use_gcc)
 
-def to_json(path):
-    converter = _create_converter(path)
-    for filename in target_files(path):
-        converter.process_idl_file(filename)
+
+def _parse_in_worker(filename):
+    return _worker_converter.parse_and_store_idl_file(filename)
+
+
+def to_json(path, jobs=1, cache=None, use_gcc=False):
+    """Converts the IDL files under |path|, parsing them in |jobs|
+    processes. Definitions are merged in file order once all are parsed.
+
+    |cache| is an IdlCache for intermediate results; files whose parsed
+    definitions are cached from an earlier run aren't parsed again. WebKit
+    IDLs are preprocessed with gcc only if |use_gcc| is True or they use
+    more than conditionals.
+    """
+    converter = _create_converter(path, cache, use_gcc)
+    filenames = list(target_files(path))
+    cached = [converter.load_parsed_file(filename) for filename in filenames]
+    changed = [filename for filename, parsed in zip(filenames, cached)
+               if parsed is None]
+    if jobs <= 1 or len(changed) <= 1:
+        parsed_changed = map(converter.parse_and_store_idl_file, changed)
+    else:
+        pool = multiprocessing.Pool(min(jobs, len(changed)), _init_worker,
+                                    (path, cache, use_gcc))
+        try:
+            parsed_changed = pool.map(_parse_in_worker, changed, chunksize=8)
+        finally:
+            pool.close()
+            pool.join()
+    parsed_changed = iter(parsed_changed)
+    # Merging is cheap compared to parsing, and redoing it from the
+    # per-file definitions gives the same result as a full run.
+    for parsed in cached:
+        converter.add_parsed_file(
+            parsed if parsed is not None else next(parsed_changed))
     return converter.to_json()
 
 
+def parse_args(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', help='IDL file or directory.')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='Number of worker processes.')
+    parser.add_argument('--cache-dir', dest='cache_dir',
+                        default=DEFAULT_CACHE_DIR,
+                        help='Where to cache intermediate results.')
+    parser.add_argument('--no-cache', dest='cache_dir', action='store_const',
+                        const=None, help='Do not use the cache.')
+    parser.add_argument('--gcc', dest='use_gcc', action='store_true',
+                        help='Always preprocess WebKit IDLs with gcc.')
+    return parser.parse_args(args)
+
+
 def main(args):
-    print to_json(args[0])
+    opts = parse_args(args)
+    cache = IdlCache(opts.cache_dir) if opts.cache_dir else None
+    print to_json(opts.path, opts.jobs, cache, opts.use_gcc)
 
 
 if __name__ == '__main__':
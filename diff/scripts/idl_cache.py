@@ -0,0 +1,52 @@
+"""On-disk cache of intermediate results of definitions_to_json.
+
+Values are pickled into one file per key under a namespace directory.
+Keys are content hashes (or hashes of paths whose entries store the
+content hash), so stale entries are simply never looked up again or get
+overwritten.
+"""
+
+import cPickle as pickle
+import hashlib
+import os
+
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.expanduser('~'), '.cache', 'blink-misc', 'idl')
+
+
+def digest(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+class IdlCache(object):
+    def __init__(self, directory=DEFAULT_CACHE_DIR):
+        self._directory = directory
+
+    def _path(self, namespace, key):
+        return os.path.join(self._directory, namespace, key)
+
+    def get(self, namespace, key, default=None):
+        try:
+            with open(self._path(namespace, key), 'rb') as f:
+                return pickle.load(f)
+        except Exception:
+            # Missing, truncated or pickled by an incompatible version.
+            return default
+
+    def put(self, namespace, key, value):
+        path = self._path(namespace, key)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Another worker may have created it.
+                if not os.path.isdir(directory):
+                    raise
+        # Write to a temporary file first so that concurrent readers never
+        # see a partial entry.
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'wb') as f:
+            pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, path)
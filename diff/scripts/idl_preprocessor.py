@@ -0,0 +1,184 @@
+"""A minimal C preprocessor for WebKit IDL files.
+
+WebKit IDLs only use conditionals (#if, #ifdef, #ifndef, #elif, #else,
+#endif) on macros which are never defined when preprocessing with plain
+`gcc -E -P -x c++`, so every macro is treated as undefined (and 0).
+Comments are removed and excluded lines are dropped as gcc does.
+Anything else raises UnsupportedDirective so that callers can fall back
+to gcc.
+"""
+
+import re
+
+
+class UnsupportedDirective(Exception):
+    pass
+
+
+# Comments, or string literals which may contain comment-like text.
+_COMMENT_RE = re.compile(r'//[^\n]*|/\*.*?\*/|"(?:\\.|[^"\\\n])*"', re.S)
+_DIRECTIVE_RE = re.compile(r'^\s*#\s*(\w*)\s*(.*?)\s*$')
+_TOKEN_RE = re.compile(r'\s*(defined\b|\w+|&&|\|\||==|!=|<=|>=|[!()<>])')
+
+# Binary operators of #if expressions from the lowest precedence to the
+# highest, as in C. Results are ints, so comparisons don't chain.
+_BINARY_OPERATORS = [
+    {'||': lambda a, b: int(bool(a or b))},
+    {'&&': lambda a, b: int(bool(a and b))},
+    {'==': lambda a, b: int(a == b), '!=': lambda a, b: int(a != b)},
+    {'<': lambda a, b: int(a < b), '>': lambda a, b: int(a > b),
+     '<=': lambda a, b: int(a <= b), '>=': lambda a, b: int(a >= b)},
+]
+
+_IDENTIFIER_RE = re.compile(r'^[A-Za-z_]\w*$')
+
+
+def _strip_comment(match):
+    text = match.group(0)
+    if text.startswith('"'):
+        return text
+    # Keep line breaks so that directives stay at the start of lines.
+    return ' ' + '\n' * text.count('\n')
+
+
+def _tokenize(expression):
+    tokens = []
+    position = 0
+    while position < len(expression):
+        match = _TOKEN_RE.match(expression, position)
+        if not match:
+            raise UnsupportedDirective('#if %s' % expression)
+        tokens.append(match.group(1))
+        position = match.end()
+    return tokens
+
+
+class _Evaluator(object):
+    """Evaluates an #if expression by recursive descent with C precedence.
+
+    No macro is defined, so every identifier is 0.
+    """
+
+    def __init__(self, expression):
+        self._expression = expression
+        self._tokens = _tokenize(expression)
+        self._position = 0
+
+    def _unsupported(self):
+        return UnsupportedDirective('#if %s' % self._expression)
+
+    def _peek(self):
+        if self._position < len(self._tokens):
+            return self._tokens[self._position]
+        return None
+
+    def _next(self):
+        token = self._peek()
+        if token is None:
+            raise self._unsupported()
+        self._position += 1
+        return token
+
+    def _expect(self, token):
+        if self._next() != token:
+            raise self._unsupported()
+
+    def evaluate(self):
+        value = self._binary(0)
+        if self._peek() is not None:
+            raise self._unsupported()
+        return bool(value)
+
+    def _binary(self, level):
+        if level == len(_BINARY_OPERATORS):
+            return self._unary()
+        operators = _BINARY_OPERATORS[level]
+        value = self._binary(level + 1)
+        while self._peek() in operators:
+            operator = operators[self._next()]
+            value = operator(value, self._binary(level + 1))
+        return value
+
+    def _unary(self):
+        token = self._next()
+        if token == '!':
+            return int(not self._unary())
+        if token == '(':
+            value = self._binary(0)
+            self._expect(')')
+            return value
+        if token == 'defined':
+            # defined X or defined(X); no macro is defined.
+            parenthesized = self._peek() == '('
+            if parenthesized:
+                self._next()
+            if not _IDENTIFIER_RE.match(self._next()):
+                raise self._unsupported()
+            if parenthesized:
+                self._expect(')')
+            return 0
+        if token.isdigit():
+            # A leading 0 means octal, as in C.
+            try:
+                return int(token, 8 if token.startswith('0') else 10)
+            except ValueError:
+                raise self._unsupported()
+        if _IDENTIFIER_RE.match(token):
+            # Function-like macros such as ENABLE(FOO) need their
+            # definitions, which only gcc knows.
+            if self._peek() == '(':
+                raise self._unsupported()
+            return 0
+        raise self._unsupported()
+
+
+def _evaluate(expression):
+    return _Evaluator(expression).evaluate()
+
+
+def preprocess(content):
+    """Returns |content| with comments and excluded sections removed."""
+    content = _COMMENT_RE.sub(_strip_comment, content)
+    # Each entry is [active, taken] of an enclosing conditional: whether
+    # its current branch is included, and whether any branch was.
+    stack = []
+    output = []
+    for line in content.split('\n'):
+        match = _DIRECTIVE_RE.match(line)
+        active = all(entry[0] for entry in stack)
+        if not match:
+            if active and line.strip():
+                output.append(line)
+            continue
+        directive, argument = match.groups()
+        if directive in ('if', 'ifdef', 'ifndef'):
+            if directive == 'if':
+                value = _evaluate(argument) if active else False
+            else:
+                # No macro is defined.
+                value = directive == 'ifndef'
+            stack.append([value, value])
+        elif directive in ('elif', 'else'):
+            if not stack:
+                raise UnsupportedDirective('#%s without #if' % directive)
+            entry = stack.pop()
+            outer = all(e[0] for e in stack)
+            if entry[1]:
+                value = False
+            elif directive == 'elif':
+                value = _evaluate(argument) if outer else False
+            else:
+                value = True
+            stack.append([value, entry[1] or value])
+        elif directive == 'endif':
+            if not stack:
+                raise UnsupportedDirective('#endif without #if')
+            stack.pop()
+        elif not active:
+            # Directives in excluded sections are ignored, as in cpp.
+            continue
+        else:
+            raise UnsupportedDirective('#%s' % directive)
+    if stack:
+        raise UnsupportedDirective('Unterminated #if')
+    return '\n'.join(output) + '\n'
@@ -1,14 +1,21 @@
-import base64
 import json
-import hyou
+import multiprocessing
 from optparse import OptionParser
+import os
+import sqlite3
 import time
-import re
 import sys
-import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+from util.allocator_tree import build_allocator_tree
+from util.compact_trace import compact_events
+from util.read_trace import iter_trace_events
+from util.trace_index import TraceIndex
 
 # Prerequisite:
-# 1. Install hyou
+# 1. Install hyou (only needed to upload to the spreadsheet)
 #    $ pip install --user hyou
 # 2. Prepare credential and let bashi@ know your client id.
 #    https://hyou.readthedocs.org/en/latest/#preparing-credentials
@@ -27,97 +34,80 @@ import zlib
 # 3. Open the following URL.
 #    https://docs.google.com/spreadsheets/d/1WZRpkrYG6KRbVWvey_3rf-LcHKAi7a444XaT0QqHfTw/edit#gid=0
 #
-#  (Omit -c option to dump results as JSON on console)
+#  (Omit -c option to dump results as JSON on console, or use
+#   -d path/to/results.db instead to store them in a local SQLite database)
+
+_PARTITION_ALLOC_DETAIL_CATEGORIES = [
+    'vector', 'shared_buffer', 'hash_table', 'string_impl', 'others']
 
-_PAT = r'<script id="viewer-data" type="application/json">\n(.*)\n</script>'
 class HTMLTrace(object):
     def __init__(self, path=None):
         if path:
-            with open(path) as f:
-                self._html_contents = f.read()
+            self._path = path
             renderer_dump = self._get_renderer_dump()
-            self.partitions = self._partitions_sizes(renderer_dump)
-            self.partitions_allocated_sizes = self._partitions_allocated_objects_sizes(renderer_dump)
-            self.partition_details = self._partition_alloc_details(renderer_dump)
+            # Allocator names and attributes are decoded once; everything
+            # below is a lookup on this tree.
+            self.allocators = build_allocator_tree(
+                renderer_dump['args']['dumps']['allocators'])
+            self.partitions = self._partitions_sizes(self.allocators)
+            self.partitions_allocated_sizes = self._partitions_allocated_objects_sizes(self.allocators)
+            self.partition_details = self._partition_alloc_details(self.allocators)
         else:
+            self.allocators = None
             self.partitions = {}
+            self.partitions_allocated_sizes = {}
             self.partition_details = {}
 
-    def _get_viewer_data(self):
-        pattern = re.compile(_PAT, re.MULTILINE)
-        m = pattern.search(self._html_contents)
-        return m.group(1)
-
     def _get_trace_data(self):
-        viewer_data = self._get_viewer_data()
-        compressed = base64.b64decode(viewer_data)
-        raw_data = zlib.decompress(compressed, zlib.MAX_WBITS|32)
-        result = json.loads(raw_data)
-        return result
+        # Memory-maps the HTML and inflates viewer-data chunk by chunk.
+        return compact_events(iter_trace_events(self._path))
 
-    def _get_renderer_pid(self, trace_data):
+    def _get_renderer_pid(self, index):
         # Assuming that the target renderer process is labeled.
-        def filter_func(dump):
-            return dump['name'] == 'process_labels'
-        dumps = filter(filter_func, trace_data)
+        dumps = index.by_name('process_labels')
         assert(len(dumps) == 1)
         return dumps[0]['pid']
 
-    def _find_explicit_dump(self, trace_data, pid):
-        def filter_func(dump):
-            return dump['name'] == 'explicitly_triggered' and dump['pid'] == pid
-        dumps = filter(filter_func, trace_data)
+    def _find_explicit_dump(self, index, pid):
+        dumps = index.by_pid_and_name(pid, 'explicitly_triggered')
         assert(len(dumps) == 1)
         return dumps[0]
 
     def _get_renderer_dump(self):
-        trace_data = self._get_trace_data()
-        pid = self._get_renderer_pid(trace_data)
-        return self._find_explicit_dump(trace_data, pid)
+        index = TraceIndex(self._get_trace_data())
+        pid = self._get_renderer_pid(index)
+        return self._find_explicit_dump(index, pid)
 
-    def _partition_alloc_details(self, renderer_dump):
+    def _partition_alloc_details(self, allocators):
         details = {
             'buffer': {},
             'fast_malloc': {},
         }
-        allocators = renderer_dump['args']['dumps']['allocators']
-        for fullname, dump in allocators.iteritems():
-            parts = fullname.split('/')
-            if parts[0] != 'partition_alloc_details':
+        for partition, categories in details.iteritems():
+            node = allocators.find('partition_alloc_details/' + partition)
+            if node is None:
                 continue
-            partition = parts[1]
-            category = parts[2]
-            if len(parts) <= 3 and category in ['vector', 'shared_buffer', 'hash_table', 'string_impl', 'others']:
-                details[partition][category] = int(dump['attrs']['size']['value'], 16)
+            for category in _PARTITION_ALLOC_DETAIL_CATEGORIES:
+                child = node.children.get(category)
+                if child and 'size' in child.attrs:
+                    categories[category] = child.attrs['size']
         return details
 
-    def _partitions_sizes(self, renderer_dump):
-        sizes = {}
-        allocators = renderer_dump['args']['dumps']['allocators']
-        for fullname, dump in allocators.iteritems():
-            parts = fullname.split('/')
-            if not fullname.startswith('partition_alloc/partitions') or len(parts) <= 2:
-                continue
-            if parts[-1] == 'allocated_objects': # Skip allocated objects.
-                continue
-            if not dump['attrs']['size']['units'] == 'bytes':
-                continue
-            category = parts[2]
-            sizes[category] = sizes.get(category, 0) + int(dump['attrs']['size']['value'], 16)
-        return sizes
-
-    def _partitions_allocated_objects_sizes(self, renderer_dump):
-        sizes = {}
-        allocators = renderer_dump['args']['dumps']['allocators']
-        for fullname, dump in allocators.iteritems():
-            parts = fullname.split('/')
-            if not fullname.startswith('partition_alloc/partitions'):
-                continue
-            if len(parts) != 3:
-                continue
-            category = parts[2]
-            sizes[category] = sizes.get(category, 0) + int(dump['attrs']['allocated_objects_size']['value'], 16)
-        return sizes
+    def _partitions_sizes(self, allocators):
+        partitions = allocators.find('partition_alloc/partitions')
+        if partitions is None:
+            return {}
+        return {category: node.subtotals['size']
+                for category, node in partitions.children.iteritems()
+                if 'size' in node.subtotals}
+
+    def _partitions_allocated_objects_sizes(self, allocators):
+        partitions = allocators.find('partition_alloc/partitions')
+        if partitions is None:
+            return {}
+        return {category: node.attrs['allocated_objects_size']
+                for category, node in partitions.children.iteritems()
+                if 'allocated_objects_size' in node.attrs}
 
 
 # TODO(bashi): We can't report 'malloc' because we use stl containers to
@@ -125,31 +115,66 @@ class HTMLTrace(object):
 _ALLOCATORS_TO_REPORT = [
     'partition_alloc', 'blink_gc', 'v8', 'skia', 'discardable', 'cc', 'malloc']
 
+def _load_html_trace(path):
+    if not path:
+        return HTMLTrace() # An error occurred on this page.
+    return HTMLTrace(path)
+
+
+def _load_html_traces(paths, jobs):
+    """Loads HTMLTraces for |paths| in |jobs| worker processes.
+
+    The largest traces are started first so that they don't end up running
+    alone at the end.
+    """
+    if jobs <= 1:
+        return map(_load_html_trace, paths)
+    order = sorted(range(len(paths)), reverse=True,
+                   key=lambda i: os.path.getsize(paths[i]) if paths[i] else 0)
+    pool = multiprocessing.Pool(jobs)
+    try:
+        loaded = pool.map(_load_html_trace, [paths[i] for i in order],
+                          chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    html_traces = [None] * len(paths)
+    for i, html_trace in zip(order, loaded):
+        html_traces[i] = html_trace
+    return html_traces
+
+
 class TelemetoryResults(object):
-    def __init__(self, results_json_path):
+    def __init__(self, results_json_path, jobs=1):
         with open(results_json_path) as f:
             self._results = json.load(f)
-        self.pages = self._read_pages()
-
-    def _read_html_traces(self, page_id):
-        values = filter(lambda v: v['page_id'] == page_id and v['type'] == 'trace',
-                        self._results['per_page_values'])
+        self._index_values()
+        self.pages = self._read_pages(jobs)
+
+    def _index_values(self):
+        # page_id -> trace values, and (page_id, name) -> values.
+        self._trace_values = {}
+        self._named_values = {}
+        for v in self._results['per_page_values']:
+            page_id = v['page_id']
+            if v['type'] == 'trace':
+                self._trace_values.setdefault(page_id, []).append(v)
+            self._named_values.setdefault((page_id, v['name']), []).append(v)
+
+    def _html_trace_path(self, page_id):
+        values = self._trace_values.get(page_id, [])
         assert(len(values) <= 1)
         if not values:
-            return HTMLTrace() # An error occurred on this page.
-        else:
-            file_id = values[0]['file_id']
-            path = self._results['files'][str(file_id)]
-            return HTMLTrace(path)
+            return None
+        file_id = values[0]['file_id']
+        return self._results['files'][str(file_id)]
 
     def _allocator_sizes(self, page_id):
-        values = filter(lambda v: v['page_id'] == page_id,
-                        self._results['per_page_values'])
         allocator_sizes = {}
         for allocator in _ALLOCATORS_TO_REPORT:
             name = 'memory_allocator_%s_renderer' % allocator
-            sizes = [v['values'][0] for v in values
-                     if v['name'] == name]
+            sizes = [v['values'][0] for v
+                     in self._named_values.get((page_id, name), [])]
             assert(len(sizes) <= 1)
             if not sizes:
                 allocator_sizes[allocator] = 0
@@ -157,11 +182,14 @@ class TelemetoryResults(object):
                 allocator_sizes[allocator] = sizes[0]
         return allocator_sizes
 
-    def _read_pages(self):
+    def _read_pages(self, jobs):
+        page_values = self._results['pages'].values()
+        html_traces = _load_html_traces(
+            [self._html_trace_path(value['id']) for value in page_values],
+            jobs)
         pages = {}
-        for value in self._results['pages'].itervalues():
+        for value, html_trace in zip(page_values, html_traces):
             page_id = value['id']
-            html_trace = self._read_html_traces(page_id)
             allocator_sizes = self._allocator_sizes(page_id)
             name = value['name']
             pages[name] = {
@@ -183,6 +211,8 @@ class SpreadSheetUpdater(object):
         self._prefix = time.strftime('%Y%m%d-%H%M%S')
 
     def upload(self, results):
+        # Only needed for this sink.
+        import hyou
         collection = hyou.login(self._credential_path)
         spreadsheet = collection[self._sheet_id]
         sorted_results = sorted(results.values(),
@@ -266,31 +296,161 @@ class SpreadSheetUpdater(object):
         worksheet.commit()
 
 
-def _parse_options():
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS allocator_sizes (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    page TEXT NOT NULL,
+    allocator TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    PRIMARY KEY (run_id, page, allocator)
+);
+CREATE TABLE IF NOT EXISTS partition_sizes (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    page TEXT NOT NULL,
+    partition TEXT NOT NULL,
+    size INTEGER,
+    allocated_size INTEGER,
+    PRIMARY KEY (run_id, page, partition)
+);
+CREATE TABLE IF NOT EXISTS partition_details (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    page TEXT NOT NULL,
+    partition TEXT NOT NULL,
+    category TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    PRIMARY KEY (run_id, page, partition, category)
+);
+CREATE INDEX IF NOT EXISTS allocator_sizes_by_page
+    ON allocator_sizes (page, allocator, run_id);
+CREATE INDEX IF NOT EXISTS partition_sizes_by_page
+    ON partition_sizes (page, partition, run_id);
+CREATE INDEX IF NOT EXISTS partition_details_by_page
+    ON partition_details (page, partition, category, run_id);
+"""
+
+
+class SQLiteResultsStore(object):
+    """Stores results in a local SQLite database, one transaction per run.
+
+    Rows are keyed by run, page and allocator or partition, and indexed by
+    page so that a page can be compared across runs.
+    """
+
+    def __init__(self, database_path, run_name=None):
+        self._database_path = database_path
+        self._run_name = run_name or time.strftime('%Y%m%d-%H%M%S')
+
+    def _connect(self):
+        conn = sqlite3.connect(self._database_path)
+        conn.executescript(_SCHEMA)
+        return conn
+
+    def upload(self, results):
+        allocator_rows = []
+        partition_rows = []
+        detail_rows = []
+        for page_values in results.itervalues():
+            page = page_values.get('name', '<unknown>')
+            for allocator, size in page_values['allocator_sizes'].iteritems():
+                allocator_rows.append((page, allocator, size))
+            partitions = page_values['partitions']
+            allocated_sizes = page_values['partitions_allocated_sizes']
+            for partition in set(partitions) | set(allocated_sizes):
+                partition_rows.append((page, partition,
+                                       partitions.get(partition),
+                                       allocated_sizes.get(partition)))
+            for partition, details in page_values['partition_details'].iteritems():
+                for category, size in details.iteritems():
+                    detail_rows.append((page, partition, category, size))
+
+        conn = self._connect()
+        try:
+            with conn:
+                run_id = self._insert_run(conn)
+                conn.executemany(
+                    'INSERT INTO allocator_sizes VALUES (?, ?, ?, ?)',
+                    [(run_id,) + row for row in allocator_rows])
+                conn.executemany(
+                    'INSERT INTO partition_sizes VALUES (?, ?, ?, ?, ?)',
+                    [(run_id,) + row for row in partition_rows])
+                conn.executemany(
+                    'INSERT INTO partition_details VALUES (?, ?, ?, ?, ?)',
+                    [(run_id,) + row for row in detail_rows])
+        finally:
+            conn.close()
+
+    def _insert_run(self, conn):
+        # Run names are unique; the default one only has one-second
+        # resolution, so add a suffix when it is taken.
+        name = self._run_name
+        suffix = 1
+        while True:
+            try:
+                return conn.execute('INSERT INTO runs (name) VALUES (?)',
+                                    (name,)).lastrowid
+            except sqlite3.IntegrityError:
+                suffix += 1
+                name = '%s-%d' % (self._run_name, suffix)
+
+    def page_history(self, page, num_runs):
+        """Returns [(run_name, {allocator: size})] of the last |num_runs|."""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                'SELECT runs.name, allocator, size FROM allocator_sizes '
+                'JOIN (SELECT id, name FROM runs ORDER BY id DESC LIMIT ?) '
+                'AS runs ON runs.id = run_id '
+                'WHERE page = ? ORDER BY run_id', (num_runs, page)).fetchall()
+        finally:
+            conn.close()
+        history = []
+        for run_name, allocator, size in rows:
+            if not history or history[-1][0] != run_name:
+                history.append((run_name, {}))
+            history[-1][1][allocator] = size
+        return history
+
+
+def _parse_options(args=None):
     parser = OptionParser()
     parser.add_option('-c', '--credential', dest='credential',
                       help='path to credential.json')
-    return parser.parse_args()
+    parser.add_option('-d', '--database', dest='database',
+                      help='path to a SQLite database to store results in')
+    parser.add_option('-j', '--jobs', dest='jobs', type='int', default=1,
+                      help='number of processes to decode traces')
+    return parser.parse_args(args)
 
 
-def report_as_dict(results_json_path):
-    return TelemetoryResults(results_json_path).pages
+def report_as_dict(results_json_path, jobs=1):
+    return TelemetoryResults(results_json_path, jobs).pages
 
 
-def upload_to_spreadsheet(results_json_path, credential_path):
-    results = TelemetoryResults(results_json_path).pages
+def upload_to_spreadsheet(results_json_path, credential_path, jobs=1):
+    results = TelemetoryResults(results_json_path, jobs).pages
     updater = SpreadSheetUpdater(
         credential_path,
         '1WZRpkrYG6KRbVWvey_3rf-LcHKAi7a444XaT0QqHfTw')
     updater.upload(results)
 
 
-def main():
-    opts, args = _parse_options()
+def store_to_database(results_json_path, database_path, jobs=1):
+    results = TelemetoryResults(results_json_path, jobs).pages
+    SQLiteResultsStore(database_path).upload(results)
+
+
+def main(args=None):
+    opts, args = _parse_options(args)
     if opts.credential:
-        upload_to_spreadsheet(args[0], opts.credential)
+        upload_to_spreadsheet(args[0], opts.credential, opts.jobs)
+    elif opts.database:
+        store_to_database(args[0], opts.database, opts.jobs)
     else:
-        results = report_as_dict(args[0])
+        results = report_as_dict(args[0], opts.jobs)
         print(json.dumps(results, indent=2))
 
 
@@ -1,37 +1,111 @@
+import argparse
+import functools
 import json
 import math
+import multiprocessing
 import os
 import sys
 
+from util.read_trace import iter_trace_events
+from util.stats import QuantileSketch, RunningStats
+from util.trace_events import add_process_labels
+
+
+class LabelStats(object):
+    """Summary of the peak sizes of one label."""
+
+    def __init__(self):
+        self.running = RunningStats()
+        self.quantiles = QuantileSketch()
+
+    def add(self, value):
+        self.running.add(value)
+        self.quantiles.add(value)
+
+    def merge(self, other):
+        self.running.merge(other.running)
+        self.quantiles.merge(other.quantiles)
+
+    def get_stats(self):
+        return {
+            'average': self.running.mean,
+            'variance': self.running.variance,
+            'hiest': self.running.hiest,
+            'lowest': self.running.lowest,
+            'count': self.running.count,
+            'median': self.quantiles.quantile(0.5),
+            'p90': self.quantiles.quantile(0.9),
+            'p99': self.quantiles.quantile(0.99),
+        }
+
 
 def calc_stats(values):
-    total = 0.0
-    doubled = 0.0
-    hiest = values[0]
-    lowest = values[0]
+    stats = LabelStats()
     for value in values:
-        total += value
-        doubled += value * value
-        if lowest > value:
-            lowest = value
-        if hiest < value:
-            hiest = value
-    average = total / len(values)
-    variance = doubled / len(values) - average * average
-    return {
-        'average': average,
-        'variance': variance,
-        'hiest': hiest,
-        'lowest': lowest,
-    }
+        stats.add(value)
+    return stats.get_stats()
 
 
 # This should be synced with mappers/peak_resident_sizes_map_function.html
 _PEAK_VALUE_NAME = 'peakResidentBytes'
+_RENDERER_PROCESS_NAME = 'Renderer'
+
+
+def extract_peak_resident_sizes(events):
+    """Finds the peak resident size of each renderer in trace |events|.
+
+    This is a streaming equivalent of
+    mappers/peak_resident_sizes_map_function.html which doesn't need the
+    catapult trace model. As in the model, labels are deduplicated and
+    timestamps are relative to the first event. Returns a mapping result
+    which can be passed to Peaks.add_mapping_result().
+    """
+    names = {}
+    labels = {}
+    peaks = {}
+    # The model shifts its timestamps so that the first event is at 0.
+    start = None
+    for event in events:
+        phase = event.get('ph')
+        pid = event.get('pid')
+        if phase != 'M' and 'ts' in event:
+            start = event['ts'] if start is None else min(start, event['ts'])
+        if phase == 'M':
+            if event.get('name') == 'process_name':
+                names[pid] = event['args']['name']
+            elif event.get('name') == 'process_labels':
+                add_process_labels(labels.setdefault(pid, []),
+                                   event['args']['labels'])
+        elif phase == 'v':
+            dumps = event.get('args', {}).get('dumps', {})
+            totals = dumps.get('process_totals', {})
+            if 'peak_resident_set_size' not in totals:
+                continue
+            size = int(totals['peak_resident_set_size'], 16)
+            timestamp = event['ts']
+            peak = peaks.get(pid)
+            if (peak is None or peak['size'] < size or
+                    (peak['size'] == size and peak['timestamp'] > timestamp)):
+                peaks[pid] = {'size': size, 'timestamp': timestamp}
+
+    values = {}
+    for pid, peak in peaks.iteritems():
+        if names.get(pid) != _RENDERER_PROCESS_NAME or peak['size'] <= 0:
+            continue
+        values[pid] = {
+            'pid': pid,
+            'name': names[pid],
+            'label': ', '.join(labels.get(pid, [])),
+            'size': peak['size'],
+            # In milliseconds as in the trace model.
+            'timestamp': (peak['timestamp'] - start) / 1000.0,
+        }
+    return {'values': [{'name': _PEAK_VALUE_NAME, 'value': values}]}
+
 
 class Peaks(object):
     def __init__(self):
-        # label -> peaks
+        # label -> LabelStats
         self._pages = {}
 
     def add_mapping_result(self, results):
@@ -40,30 +114,89 @@ class Peaks(object):
         for value in peak_values:
             for peak in value['value'].itervalues():
                 label = peak['label']
-                if not label in self._pages.keys():
-                    self._pages[label] = []
-                self._pages[label].append(peak['size'])
+                if label not in self._pages:
+                    self._pages[label] = LabelStats()
+                self._pages[label].add(peak['size'])
+
+    def add_trace(self, path):
+        """Adds the peaks of a raw trace without a mapping step."""
+        events = iter_trace_events(path)
+        self.add_mapping_result(extract_peak_resident_sizes(events))
+
+    def merge(self, other):
+        for label, stats in other._pages.iteritems():
+            if label not in self._pages:
+                self._pages[label] = LabelStats()
+            self._pages[label].merge(stats)
 
     def get_stats(self):
-        return {label: calc_stats(values) for label, values
+        return {label: stats.get_stats() for label, stats
                 in self._pages.iteritems()}
 
 
-def main(args):
+def load_peaks(paths, traces=False):
+    """Loads mapping results, or raw traces if |traces| is True."""
     peaks = Peaks()
-    for path in args:
+    for path in paths:
+        if traces:
+            peaks.add_trace(path)
+            continue
         with open(path) as f:
             obj = json.load(f)
         peaks.add_mapping_result(obj)
+    return peaks
+
+
+# Each worker gets several shards so that a slow shard doesn't leave the
+# other workers idle at the end.
+_SHARDS_PER_JOB = 4
+
+
+def load_peaks_parallel(paths, jobs, traces=False):
+    """Loads |paths| in |jobs| worker processes and merges their Peaks."""
+    num_shards = min(len(paths), jobs * _SHARDS_PER_JOB)
+    shards = [paths[i::num_shards] for i in range(num_shards)]
+    peaks = Peaks()
+    pool = multiprocessing.Pool(jobs)
+    try:
+        load = functools.partial(load_peaks, traces=traces)
+        for partial in pool.imap_unordered(load, shards):
+            peaks.merge(partial)
+    finally:
+        pool.close()
+        pool.join()
+    return peaks
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('paths', nargs='+', metavar='path')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1,
+                        help='Number of worker processes.')
+    parser.add_argument('-t', '--traces', dest='traces', action='store_true',
+                        help='Inputs are raw traces (.json, .json.gz or '
+                        '.html) instead of mapping results.')
+    return parser.parse_args(args)
+
+
+def main(args):
+    opts = parse_args(args)
+    if opts.jobs > 1:
+        peaks = load_peaks_parallel(opts.paths, opts.jobs, opts.traces)
+    else:
+        peaks = load_peaks(opts.paths, opts.traces)
     stats = peaks.get_stats()
     for label in sorted(stats):
         stat = stats[label]
-        print('[%s]\n%.2f, %.2f, %.2f, %.2f' % (
+        print('[%s]\n%.2f, %.2f, %.2f, %.2f, %.2f, %.2f, %.2f' % (
             label.encode('utf-8'),
             stat['average'] / 1024**2,
             float(stat['lowest']) / 1024**2,
             float(stat['hiest']) / 1024**2,
-            math.sqrt(stat['variance']) / 1024**2))
+            math.sqrt(stat['variance']) / 1024**2,
+            float(stat['median']) / 1024**2,
+            float(stat['p90']) / 1024**2,
+            float(stat['p99']) / 1024**2))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,120 @@
+"""A fake devil DeviceUtils which "traces" URLs in memory."""
+
+import gzip
+import io
+import json
+import re
+
+
+class FakeLogcatMonitor(object):
+    def __init__(self, device):
+        self._device = device
+
+    def Start(self):
+        self._device.logcat = []
+
+    def _search(self, regexp):
+        # Like devil, searches everything logged since Start().
+        for line in self._device.logcat:
+            match = regexp.search(line)
+            if match:
+                return match
+        return None
+
+    def WaitFor(self, regexp, timeout=None):
+        match = self._search(regexp)
+        if not match:
+            # Time passes only while someone waits.
+            self._device.finish_tracing()
+            match = self._search(regexp)
+        if not match:
+            raise Exception('Timed out waiting for ' + regexp.pattern)
+        return match
+
+
+class FakeProcess(object):
+    def __init__(self, stdout, returncode=0, stderr=b''):
+        self.stdout = io.BytesIO(stdout)
+        self.stderr = io.BytesIO(stderr)
+        self.returncode = None
+        self._exit_code = returncode
+        self.killed = False
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self):
+        if self.returncode is None:
+            self.returncode = self._exit_code
+        return self.returncode
+
+    def kill(self):
+        self.killed = True
+        self.returncode = -9
+
+
+class FakeDevice(object):
+    """Opening a URL starts tracing; once the logcat monitor has waited,
+    a trace naming the URL is in the file given by --trace-startup-file
+    and the message chrome logs is in logcat."""
+
+    def __init__(self, serial='fake-serial'):
+        self._serial = serial
+        self.files = {}
+        self.logcat = []
+        self.opened_urls = []
+        self.processes = []
+        self._tracing = None
+
+    def __str__(self):
+        return self._serial
+
+    def GetLogcatMonitor(self):
+        return FakeLogcatMonitor(self)
+
+    def WriteFile(self, path, contents, as_root=False):
+        self.files[path] = contents
+
+    def RunShellCommand(self, cmd, as_root=False):
+        if cmd[:2] == ['rm', '-f']:
+            self.files.pop(cmd[2], None)
+
+    def KillAll(self, name, blocking=False):
+        pass
+
+    def StartActivity(self, url):
+        self.opened_urls.append(url)
+        command_line = self.files['/data/local/chrome-command-line']
+        trace_file = re.search(r'--trace-startup-file=(\S+)',
+                               command_line).group(1)
+        self._tracing = (url, trace_file)
+
+    def finish_tracing(self):
+        if not self._tracing:
+            return
+        url, trace_file = self._tracing
+        self._tracing = None
+        self.files[trace_file] = json.dumps([
+            {'ph': 'M', 'name': 'process_name', 'pid': 1,
+             'args': {'name': 'Renderer'}},
+            {'ph': 'X', 'name': url, 'pid': 1, 'ts': 0},
+        ])
+        self.logcat.append('I/chromium: Completed startup tracing to ' +
+                           trace_file)
+
+    def FileSize(self, path):
+        return len(self.files[path])
+
+    def StartExecOut(self, cmd):
+        if cmd[:2] != ['gzip', '-c']:
+            raise Exception('Unexpected command: %s' % cmd)
+        data = io.BytesIO()
+        with gzip.GzipFile(fileobj=data, mode='wb') as f:
+            f.write(self.files[cmd[2]])
+        process = FakeProcess(data.getvalue())
+        self.processes.append(process)
+        return process
+
+    def PullFile(self, device_path, host_path):
+        with open(host_path, 'w') as f:
+            f.write(self.files[device_path])
@@ -0,0 +1,43 @@
+import unittest
+
+from util.memory_timeline import TimelineBuilder
+
+
+def _size(value):
+    return {'size': {'type': 'scalar', 'units': 'bytes',
+                     'value': '%x' % value}}
+
+
+def _dump(ts, allocators):
+    return {'ph': 'v', 'pid': 1, 'ts': ts,
+            'args': {'dumps': {'allocators': {
+                name: {'attrs': _size(value)}
+                for name, value in allocators.iteritems()}}}}
+
+
+class TimelineBuilderTest(unittest.TestCase):
+    def _means(self, events):
+        builder = TimelineBuilder(num_buckets=10)
+        builder.add_events(events)
+        return {allocator: series['mean']
+                for allocator, series in builder.timelines()[1].iteritems()}
+
+    def test_parent_total_is_not_added_to_its_children(self):
+        means = self._means([_dump(0, {
+            'malloc': 100,
+            'malloc/metadata_fragmentation_caches': 10,
+            'malloc/allocated_objects': 80,
+        })])
+        self.assertEqual(means['malloc'], [100.0])
+
+    def test_children_are_summed_without_a_parent_total(self):
+        means = self._means([_dump(0, {
+            'partition_alloc/partitions/buffer': 30,
+            'partition_alloc/partitions/buffer/bucket_32': 20,
+            'partition_alloc/partitions/layout': 12,
+        })])
+        self.assertEqual(means['partition_alloc'], [42.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
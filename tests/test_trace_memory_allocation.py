@@ -0,0 +1,163 @@
+import gzip
+import json
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+import trace_memory_allocation
+from tests.fake_device import FakeDevice, FakeProcess
+
+
+class DisconnectedDevice(FakeDevice):
+    def __init__(self, serial):
+        super(DisconnectedDevice, self).__init__(serial)
+        self.attempts = 0
+
+    def StartActivity(self, url):
+        self.attempts += 1
+        raise Exception('device not found')
+
+
+class BrokenGzipDevice(FakeDevice):
+    def StartExecOut(self, cmd):
+        process = FakeProcess(b'not gzip data', returncode=1,
+                              stderr=b'gzip: error')
+        self.processes.append(process)
+        return process
+
+
+class FailingUrlDevice(FakeDevice):
+    def __init__(self, failing_url):
+        super(FailingUrlDevice, self).__init__()
+        self._failing_url = failing_url
+
+    def StartActivity(self, url):
+        if url == self._failing_url:
+            raise Exception('cannot open ' + url)
+        super(FailingUrlDevice, self).StartActivity(url)
+
+
+def _traced_url(path):
+    with (gzip.open(path) if path.endswith('.gz') else open(path)) as f:
+        return [event['name'] for event in json.load(f)
+                if event['ph'] == 'X'][0]
+
+
+class RunnerTest(unittest.TestCase):
+    def setUp(self):
+        self._output_dir = tempfile.mkdtemp()
+        self._poll_interval = trace_memory_allocation._POLL_INTERVAL
+        trace_memory_allocation._POLL_INTERVAL = 0
+
+    def tearDown(self):
+        trace_memory_allocation._POLL_INTERVAL = self._poll_interval
+        shutil.rmtree(self._output_dir)
+
+    def _create_runner(self, device, compress=False):
+        return trace_memory_allocation.Runner(
+            10, device=device, compress=compress,
+            create_intent=lambda url: url)
+
+    def test_run_pulls_the_trace_of_each_url(self):
+        device = FakeDevice()
+        urls = ['http://a.test/', 'http://b.test/', 'http://c.test/']
+        host_files = self._create_runner(device).run(urls, self._output_dir)
+        self.assertEqual(urls, device.opened_urls)
+        self.assertEqual(urls, [_traced_url(path) for path in host_files])
+
+    def test_run_removes_pulled_traces_from_the_device(self):
+        device = FakeDevice()
+        for compress in (False, True):
+            self._create_runner(device, compress).run(
+                ['http://a.test/', 'http://b.test/'], self._output_dir)
+        self.assertEqual(['/data/local/chrome-command-line'],
+                         device.files.keys())
+
+    def test_run_continues_after_a_failed_url(self):
+        device = FailingUrlDevice('http://b.test/')
+        urls = ['http://a.test/', 'http://b.test/', 'http://c.test/']
+        logging.disable(logging.CRITICAL)
+        try:
+            host_files = self._create_runner(device).run(urls,
+                                                         self._output_dir)
+        finally:
+            logging.disable(logging.NOTSET)
+        self.assertIsNone(host_files[1])
+        self.assertEqual(['http://a.test/', 'http://c.test/'],
+                         [_traced_url(host_files[0]),
+                          _traced_url(host_files[2])])
+
+    def test_run_ignores_traces_of_earlier_runners(self):
+        device = FakeDevice()
+        self._create_runner(device).run(['http://old.test/'],
+                                        self._output_dir)
+        host_files = self._create_runner(device).run(['http://new.test/'],
+                                                     self._output_dir)
+        self.assertEqual(['http://new.test/'],
+                         [_traced_url(path) for path in host_files])
+
+    def test_compressed_pull_indexes_the_trace(self):
+        device = FakeDevice()
+        runner = self._create_runner(device, compress=True)
+        host_files = runner.run(['http://a.test/'], self._output_dir)
+        self.assertTrue(host_files[0].endswith('.json.gz'))
+        self.assertEqual(['http://a.test/'],
+                         [_traced_url(path) for path in host_files])
+        self.assertEqual([1], runner.trace_index.pids_of('Renderer'))
+        self.assertEqual(0, device.processes[0].returncode)
+
+    def test_failed_compressed_pull_falls_back_and_kills_process(self):
+        device = BrokenGzipDevice()
+        logging.disable(logging.CRITICAL)
+        try:
+            runner = self._create_runner(device, compress=True)
+            host_files = runner.run(['http://a.test/'], self._output_dir)
+        finally:
+            logging.disable(logging.NOTSET)
+        self.assertTrue(host_files[0].endswith('.json'))
+        self.assertFalse(os.path.exists(host_files[0] + '.gz'))
+        self.assertEqual(['http://a.test/'],
+                         [_traced_url(path) for path in host_files])
+        self.assertTrue(device.processes[0].killed)
+
+
+class RunOnDevicesTest(unittest.TestCase):
+    def setUp(self):
+        self._output_dir = tempfile.mkdtemp()
+        self._poll_interval = trace_memory_allocation._POLL_INTERVAL
+        trace_memory_allocation._POLL_INTERVAL = 0
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        trace_memory_allocation._POLL_INTERVAL = self._poll_interval
+        shutil.rmtree(self._output_dir)
+
+    def test_disconnected_device_leaves_urls_to_others(self):
+        healthy = FakeDevice('healthy')
+        disconnected = DisconnectedDevice('disconnected')
+        urls = ['http://%d.test/' % i for i in range(10)]
+        results = trace_memory_allocation.run_on_devices(
+            [disconnected, healthy], urls, output_dir=self._output_dir,
+            compress=False, create_intent=lambda url: url)
+        self.assertEqual(urls, [url for url, _ in results])
+        self.assertEqual(urls, [_traced_url(path) for _, path in results])
+        self.assertLessEqual(
+            disconnected.attempts,
+            trace_memory_allocation._MAX_CONSECUTIVE_FAILURES)
+
+    def test_disconnected_device_stops_taking_urls(self):
+        disconnected = DisconnectedDevice('disconnected')
+        urls = ['http://%d.test/' % i for i in range(10)]
+        results = trace_memory_allocation.run_on_devices(
+            [disconnected], urls, output_dir=self._output_dir,
+            compress=False, create_intent=lambda url: url)
+        self.assertEqual([None] * len(urls), [path for _, path in results])
+        self.assertEqual(trace_memory_allocation._MAX_CONSECUTIVE_FAILURES,
+                         disconnected.attempts)
+
+
+if __name__ == '__main__':
+    unittest.main()
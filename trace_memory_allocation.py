@@ -1,17 +1,17 @@
 #!/usr/bin/env python
 
 import argparse
+import logging
 import os
 import re
+import subprocess
 import sys
+import threading
 import time
 
-from util import insert_catapult_path
-
-from devil.android import device_utils
-from devil.android.logcat_monitor import LogcatMonitor
-from devil.android.sdk.adb_wrapper import AdbWrapper
-from devil.android.sdk.intent import Intent
+from benchmark.page_sets.url_manifest import load_url_manifest
+from util.read_trace import iter_compressed_trace_events
+from util.trace_index import TraceIndex
 
 
 _TRACING_CATEGORIES = ','.join([
@@ -31,27 +31,97 @@ _TRACING_CATEGORIES = ','.join([
 
 _TRACE_FILE = os.path.join('/', 'sdcard', 'Download', 'trace.json')
 _COMMAND_LINE_FILE = os.path.join('/', 'data', 'local', 'chrome-command-line')
-_TRACING_END_REGEXP = re.compile(r' Completed startup tracing to (.*)')
+_TRACING_END_MESSAGE = ' Completed startup tracing to '
+
+# How often and how long to poll the device for the trace file to be
+# completely written.
+_POLL_INTERVAL = 0.5
+_FILE_STABLE_TIMEOUT = 30
+_PULL_CHUNK_SIZE = 64 * 1024
+
+
+def _find_devices(serial=None):
+    # devil is imported lazily so that Runner can be used with a fake device
+    # without a Chromium checkout.
+    from util import insert_catapult_path
+    from devil.android import device_utils
+    from devil.android.sdk.adb_wrapper import AdbWrapper
+
+    if not AdbWrapper.IsServerOnline():
+        AdbWrapper.StartServer()
+    if serial:
+        return [device_utils.DeviceUtils(serial, default_retries=0)]
+    return device_utils.DeviceUtils.HealthyDevices(default_retries=0)
+
+
+def _create_intent(url):
+    from util import insert_catapult_path
+    from devil.android.sdk.intent import Intent
+
+    return Intent(action='android.intent.action.VIEW',
+                  package='org.chromium.chrome',
+                  activity='com.google.android.apps.chrome.Main',
+                  data=url)
+
+
+def _start_exec_out(device, cmd):
+    """Starts |cmd| on |device| and returns a process whose stdout is the
+    command's raw output and whose stderr is captured.
+
+    Devices may provide StartExecOut(cmd) for this. devil's DeviceUtils
+    has no streaming API, so `adb exec-out` is run with its adb binary.
+    """
+    start_exec_out = getattr(device, 'StartExecOut', None)
+    if start_exec_out:
+        return start_exec_out(cmd)
+    return subprocess.Popen(
+        [device.adb.GetAdbPath(), '-s', str(device), 'exec-out'] + cmd,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 
 
 class Runner(object):
-    def __init__(self, duration, serial=None):
-        if not AdbWrapper.IsServerOnline():
-            AdbWrapper.StartServer()
-        if serial:
-            devices = [device_utils.DeviceUtils(serial, default_retries=0)]
-        else:
-            devices = device_utils.DeviceUtils.HealthyDevices(default_retries=0)
-        if not devices:
-            raise ValueError('Cannot find device')
-        self._adb = devices[0]
+    """Records startup traces of URLs on a device.
+
+    |device| is a devil DeviceUtils, or any object providing the same
+    methods; the first healthy device is used if it is omitted. The logcat
+    monitor is started once and reused for every URL. Each URL is traced
+    to its own file on the device, so neither a previous trace file nor
+    its logcat message can be mistaken for the current one.
+
+    |create_intent| builds the intent to open a URL with; it defaults to
+    a devil Intent for Chromium.
+
+    If |compress| is True, traces are gzipped on the device and indexed
+    while they are transferred; the index of the last trace is kept in
+    |trace_index|.
+    """
+
+    def __init__(self, duration, serial=None, device=None, compress=True,
+                 create_intent=_create_intent):
+        if not device:
+            devices = _find_devices(serial)
+            if not devices:
+                raise ValueError('Cannot find device')
+            device = devices[0]
+        self._adb = device
         self._logcat = self._adb.GetLogcatMonitor()
         self._duration = duration
+        self._prepared = False
+        self._compress = compress
+        self._create_intent = create_intent
+        self._trace_count = 0
+        self.trace_index = None
 
-    def _config_command_line(self):
+    def _next_trace_file(self):
+        name, ext = os.path.splitext(_TRACE_FILE)
+        trace_file = '%s-%d%s' % (name, self._trace_count, ext)
+        self._trace_count += 1
+        return trace_file
+
+    def _config_command_line(self, trace_file):
         lines = ' '.join(["chrome",
                  "--trace-startup='" + _TRACING_CATEGORIES + "'",
-                 "--trace-startup-file=" + _TRACE_FILE,
+                 "--trace-startup-file=" + trace_file,
                  "--trace-startup-duration=%d" % self._duration,
                  "--enable-heap-profiling",
                  "--no-sandbox",
@@ -60,44 +130,249 @@ class Runner(object):
         self._adb.RunShellCommand(['chmod', '0664', _COMMAND_LINE_FILE],
                                   as_root=True)
 
+    def _prepare(self):
+        if self._prepared:
+            return
+        self._logcat.Start()
+        self._prepared = True
+
     def _open(self, url):
-        intent = Intent(action='android.intent.action.VIEW',
-                        package='org.chromium.chrome',
-                        activity='com.google.android.apps.chrome.Main',
-                        data=url)
-        self._adb.StartActivity(intent)
+        self._adb.StartActivity(self._create_intent(url))
 
     def _force_stop(self):
+        # Blocks until chrome is gone so that the next launch starts tracing
+        # with the current command line.
         try:
-            self._adb.KillAll('chrome')
+            self._adb.KillAll('chrome', blocking=True)
         except:
             pass
 
-    def _wait_for_tracing(self):
-        timeout = self._duration + 10
-        result = self._logcat.WaitFor(_TRACING_END_REGEXP, timeout=timeout)
-        return result.group(1)
+    def _wait_for_tracing(self, trace_file):
+        # The monitor searches everything logged since it was started, so
+        # only the message for this trace file will do.
+        regexp = re.compile(re.escape(_TRACING_END_MESSAGE + trace_file) +
+                            r'\s*$')
+        self._logcat.WaitFor(regexp, timeout=self._duration + 10)
 
-    def _pull_trace(self, trace_file):
-        time.sleep(3)
-        host_file = os.path.join(os.path.curdir, os.path.basename(trace_file))
+    def _wait_for_file(self, trace_file):
+        """Waits until the size of |trace_file| stops changing."""
+        deadline = time.time() + _FILE_STABLE_TIMEOUT
+        last_size = None
+        while time.time() < deadline:
+            size = self._adb.FileSize(trace_file)
+            if size and size == last_size:
+                return
+            last_size = size
+            time.sleep(_POLL_INTERVAL)
+        raise Exception('Trace file is not completed: ' + trace_file)
+
+    def _stream_trace(self, trace_file, host_file):
+        """Saves the gzipped |trace_file| to |host_file| and returns a
+        TraceIndex of it, parsing the trace as the bytes arrive."""
+        process = _start_exec_out(self._adb, ['gzip', '-c', trace_file])
+        try:
+            def pull():
+                with open(host_file, 'wb') as f:
+                    for chunk in iter(
+                            lambda: process.stdout.read(_PULL_CHUNK_SIZE),
+                            b''):
+                        f.write(chunk)
+                        yield chunk
+            chunks = pull()
+            index = TraceIndex(iter_compressed_trace_events(chunks))
+            # Save whatever follows the end of the JSON, e.g. the gzip
+            # trailer.
+            for _ in chunks:
+                pass
+            if process.wait() != 0:
+                raise Exception('Failed to pull %s: %s' % (
+                    trace_file, process.stderr.read().strip()))
+            return index
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+
+    def _pull_trace(self, trace_file, host_file=None):
+        self._wait_for_file(trace_file)
+        if not host_file:
+            host_file = os.path.join(os.path.curdir,
+                                     os.path.basename(_TRACE_FILE))
+        self.trace_index = None
+        if self._compress:
+            try:
+                self.trace_index = self._stream_trace(trace_file,
+                                                      host_file + '.gz')
+                return host_file + '.gz'
+            except Exception:
+                logging.warning('Compressed pull of %s failed, pulling it '
+                                'uncompressed', trace_file, exc_info=True)
+                if os.path.exists(host_file + '.gz'):
+                    os.remove(host_file + '.gz')
         self._adb.PullFile(trace_file, host_file)
         return host_file
 
-    def start(self, url):
+    def start(self, url, host_file=None):
+        self._prepare()
+        # Startup tracing only happens when chrome is launched.
         self._force_stop()
-        self._config_command_line()
-        time.sleep(2)
-        self._logcat.Start()
+        trace_file = self._next_trace_file()
+        # A file left by an earlier Runner could look complete already.
+        self._adb.RunShellCommand(['rm', '-f', trace_file], as_root=True)
+        self._config_command_line(trace_file)
         self._open(url)
-        trace_file = self._wait_for_tracing()
-        return self._pull_trace(trace_file)
+        self._wait_for_tracing(trace_file)
+        host_file = self._pull_trace(trace_file, host_file)
+        # Batches of many URLs would fill up the device otherwise.
+        self._adb.RunShellCommand(['rm', '-f', trace_file], as_root=True)
+        return host_file
+
+    def run(self, urls, output_dir=os.path.curdir):
+        """Traces |urls| one after another and returns the host files.
 
+        A URL which fails is logged and its host file is None.
+        """
+        host_files = []
+        for i, url in enumerate(urls):
+            name, ext = os.path.splitext(os.path.basename(_TRACE_FILE))
+            host_file = os.path.join(output_dir, '%s-%d%s' % (name, i, ext))
+            try:
+                host_files.append(self.start(url, host_file))
+            except Exception:
+                logging.exception('Failed to trace %s', url)
+                host_files.append(None)
+        return host_files
 
-def get_trace_for(url, duration=10):
-    r = Runner(duration)
+
+# A device which fails this many URLs in a row is assumed to be gone.
+_MAX_CONSECUTIVE_FAILURES = 3
+
+
+class _Jobs(object):
+    """(index, url) jobs shared by the device workers.
+
+    A failed job is put back for the workers which haven't failed it yet.
+    A taken job stays in flight until the worker finishes it, so workers
+    don't quit while another one may still put a failed job back.
+    """
+
+    def __init__(self, jobs):
+        self._condition = threading.Condition()
+        # Each entry is [job, set of workers which failed it].
+        self._jobs = [[job, set()] for job in jobs]
+        self._in_flight = 0
+
+    def _take_for(self, worker):
+        for i, (job, failed) in enumerate(self._jobs):
+            if worker not in failed:
+                del self._jobs[i]
+                self._in_flight += 1
+                return job, failed
+        return None
+
+    def take(self, worker):
+        """Returns the next (job, failed) for |worker|, or None once no
+        job is left for it."""
+        with self._condition:
+            while True:
+                taken = self._take_for(worker)
+                if taken or not self._in_flight:
+                    return taken
+                self._condition.wait()
+
+    def finish(self, job, failed, worker, succeeded):
+        with self._condition:
+            self._in_flight -= 1
+            if not succeeded:
+                self._jobs.append([job, failed | set([worker])])
+            self._condition.notify_all()
+
+
+def _device_worker(runner, jobs, output_dir, results):
+    failures = 0
+    while failures < _MAX_CONSECUTIVE_FAILURES:
+        taken = jobs.take(output_dir)
+        if not taken:
+            return
+        (index, url), failed = taken
+        host_file = os.path.join(output_dir, 'trace-%d.json' % index)
+        try:
+            results[index] = runner.start(url, host_file)
+            failures = 0
+        except Exception:
+            logging.exception('Failed to trace %s on %s', url, output_dir)
+            failures += 1
+        jobs.finish((index, url), failed, output_dir, results[index])
+    logging.error('Stopped using %s after %d failures in a row',
+                  output_dir, failures)
+
+
+def run_on_devices(devices, urls, duration=10, output_dir=os.path.curdir,
+                   repeat=1, compress=True, create_intent=_create_intent):
+    """Traces |urls| |repeat| times, spread over all |devices| in parallel.
+
+    Each device has its own worker thread which takes the next URL when it
+    is done with the previous one, and stores traces under
+    |output_dir|/<device serial>/. A URL which fails is put back for the
+    other devices, and a device which keeps failing stops taking URLs.
+    Returns a list of (url, host file) pairs in URL order; the host file
+    is None if tracing failed.
+    """
+    all_urls = [url for _ in range(repeat) for url in urls]
+    jobs = _Jobs(enumerate(all_urls))
+    results = [None] * len(all_urls)
+    threads = []
+    for device in devices:
+        device_dir = os.path.join(output_dir, str(device))
+        if not os.path.isdir(device_dir):
+            os.makedirs(device_dir)
+        runner = Runner(duration, device=device, compress=compress,
+                        create_intent=create_intent)
+        thread = threading.Thread(target=_device_worker,
+                                  args=(runner, jobs, device_dir, results))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    return zip(all_urls, results)
+
+
+def _print_summary(index):
+    for pid in index.pids_of('Renderer'):
+        print('  Renderer %d [%s]: %d events' % (
+            pid, ', '.join(index.process_labels.get(pid, [])),
+            len(index.by_pid(pid))))
+
+
+def get_trace_for(url, duration=10, compress=True):
+    r = Runner(duration, compress=compress)
     trace_file = r.start(url)
     print('Done: ' + os.path.abspath(trace_file))
+    if r.trace_index:
+        _print_summary(r.trace_index)
+
+
+def get_traces_for(urls, duration=10, output_dir=os.path.curdir,
+                   compress=True):
+    r = Runner(duration, compress=compress)
+    for url, trace_file in zip(urls, r.run(urls, output_dir)):
+        if trace_file:
+            print('Done: %s -> %s' % (url, os.path.abspath(trace_file)))
+        else:
+            print('Failed: %s' % url)
+
+
+def get_traces_on_all_devices(urls, duration=10, output_dir=os.path.curdir,
+                              repeat=1, compress=True):
+    devices = _find_devices()
+    if not devices:
+        raise ValueError('Cannot find device')
+    for url, trace_file in run_on_devices(devices, urls, duration,
+                                          output_dir, repeat, compress):
+        if trace_file:
+            print('Done: %s -> %s' % (url, os.path.abspath(trace_file)))
+        else:
+            print('Failed: %s' % url)
 
 
 def parse_args():
@@ -105,14 +380,39 @@ def parse_args():
     parser.add_argument('-s', '--duration', dest='duration',
                         type=int, default=10,
                         help='Time to trace allocation.')
+    parser.add_argument('-f', '--url-file', dest='url_file',
+                        help='URL manifest to trace in a batch, as for '
+                        'record_trace --url-manifest. Story names are '
+                        'ignored.')
+    parser.add_argument('-o', '--output-dir', dest='output_dir',
+                        default=os.path.curdir,
+                        help='Where to store traces of a batch.')
+    parser.add_argument('-a', '--all-devices', dest='all_devices',
+                        action='store_true',
+                        help='Spread URLs over all healthy devices.')
+    parser.add_argument('-r', '--repeat', dest='repeat', type=int, default=1,
+                        help='Number of times to trace each URL.')
+    parser.add_argument('--no-compress', dest='compress',
+                        action='store_false',
+                        help='Pull traces without gzipping them on the device.')
     return parser.parse_known_args()
 
 
 def main(args):
     opts, args = parse_args()
-    if len(args) != 1:
+    urls = list(args)
+    if opts.url_file:
+        urls.extend(url for url, _ in load_url_manifest(opts.url_file))
+    if not urls:
         raise ValueError('Must specify a URL')
-    get_trace_for(args[0], opts.duration)
+    if opts.all_devices:
+        get_traces_on_all_devices(urls, opts.duration, opts.output_dir,
+                                  opts.repeat, opts.compress)
+    elif len(urls) == 1 and not opts.url_file and opts.repeat == 1:
+        get_trace_for(urls[0], opts.duration, opts.compress)
+    else:
+        get_traces_for(urls * opts.repeat, opts.duration, opts.output_dir,
+                       opts.compress)
 
 
 if __name__ == '__main__':
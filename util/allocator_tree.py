@@ -0,0 +1,91 @@
+class AllocatorNode(object):
+    """A node of the allocator hierarchy of a memory-infra process dump.
+
+    |attrs| maps attribute names to decoded values (scalars are ints) and
+    |units| maps them to their units. |subtotals| maps every 'bytes'
+    attribute to its sum over this node and all its descendants, skipping
+    'allocated_objects' nodes which account for a subset of their parent.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.children = {}
+        self.attrs = {}
+        self.units = {}
+        self.subtotals = {}
+
+    def _set_attrs(self, attrs):
+        for attr_name, attr in attrs.iteritems():
+            value = attr.get('value')
+            if attr.get('type') == 'scalar':
+                value = int(value, 16)
+            self.attrs[attr_name] = value
+            self.units[attr_name] = attr.get('units')
+
+    def _compute_subtotals(self):
+        subtotals = {}
+        if self.name != 'allocated_objects':
+            for attr_name, value in self.attrs.iteritems():
+                if self.units[attr_name] == 'bytes':
+                    subtotals[attr_name] = value
+        for child in self.children.itervalues():
+            for attr_name, value in child._compute_subtotals().iteritems():
+                subtotals[attr_name] = subtotals.get(attr_name, 0) + value
+        self.subtotals = subtotals
+        return subtotals
+
+    def aggregate(self, attr_name):
+        """Returns |attr_name| of this node as catapult aggregates dumps.
+
+        That is the node's own value if it has one, as it already includes
+        its descendants, otherwise the sum of the aggregated values of its
+        children (except 'allocated_objects'). Returns None if no node of
+        the subtree has the attribute. Unlike |subtotals|, a parent with
+        its own total isn't counted twice.
+        """
+        if attr_name in self.attrs:
+            return self.attrs[attr_name]
+        total = None
+        for child in self.children.itervalues():
+            if child.name == 'allocated_objects':
+                continue
+            value = child.aggregate(attr_name)
+            if value is not None:
+                total = (total or 0) + value
+        return total
+
+    def find(self, path):
+        """Returns the descendant at slash-separated |path|, or None."""
+        node = self
+        for part in path.split('/'):
+            node = node.children.get(part)
+            if node is None:
+                return None
+        return node
+
+    def walk(self, prefix=''):
+        """Yields (fullname, node) for this node and all its descendants."""
+        yield prefix, self
+        for name, child in self.children.iteritems():
+            fullname = prefix + '/' + name if prefix else name
+            for item in child.walk(fullname):
+                yield item
+
+
+def build_allocator_tree(allocators):
+    """Builds a tree from the 'allocators' dict of a process memory dump.
+
+    Each full name is split and each attribute decoded exactly once.
+    Returns the unnamed root node.
+    """
+    root = AllocatorNode('')
+    for fullname, dump in allocators.iteritems():
+        node = root
+        for part in fullname.split('/'):
+            child = node.children.get(part)
+            if child is None:
+                child = node.children[part] = AllocatorNode(part)
+            node = child
+        node._set_attrs(dump.get('attrs', {}))
+    root._compute_subtotals()
+    return root
@@ -0,0 +1,104 @@
+"""Compact in-memory representation of trace events.
+
+A trace read as plain dicts repeats the same name, cat, ph and args key
+strings for every event. CompactEvent stores the common fields in slots
+with interned strings and keeps args as a compact JSON string until
+they are first accessed, while still providing the read-only dict API
+the analysis code uses (event['args'], event.get('pid'), ...).
+"""
+
+import json
+
+from util.trace_events import Interner
+
+
+_SEPARATORS = (',', ':')
+
+
+def _intern(interner, value):
+    return None if value is None else interner.canonical(value)
+
+
+class CompactEvent(object):
+    """A read-only, dict-like trace event.
+
+    'args' is decoded on its first access and the decoded dict is kept, so
+    only events whose args are actually used pay for them in memory.
+    """
+
+    __slots__ = ('name', 'cat', 'ph', 'pid', 'tid', 'ts', 'dur',
+                 '_args', '_args_json', '_rest')
+
+    _FIELDS = ('name', 'cat', 'ph', 'pid', 'tid', 'ts', 'dur')
+
+    def __init__(self, event, interner):
+        rest = dict(event)
+        self.name = _intern(interner, rest.pop('name', None))
+        self.cat = _intern(interner, rest.pop('cat', None))
+        self.ph = _intern(interner, rest.pop('ph', None))
+        self.pid = rest.pop('pid', None)
+        self.tid = rest.pop('tid', None)
+        self.ts = rest.pop('ts', None)
+        self.dur = rest.pop('dur', None)
+        args = rest.pop('args', None)
+        self._args = None
+        self._args_json = (None if args is None
+                           else json.dumps(args, separators=_SEPARATORS))
+        self._rest = rest or None
+
+    def __getitem__(self, key):
+        if key in self._FIELDS:
+            value = getattr(self, key)
+        elif key == 'args':
+            if self._args_json is not None:
+                self._args = json.loads(self._args_json)
+                self._args_json = None
+            value = self._args
+        elif self._rest and key in self._rest:
+            return self._rest[key]
+        else:
+            value = None
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def keys(self):
+        keys = [key for key in self._FIELDS if getattr(self, key) is not None]
+        if self._args is not None or self._args_json is not None:
+            keys.append('args')
+        if self._rest:
+            keys.extend(self._rest)
+        return keys
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def iteritems(self):
+        for key in self.keys():
+            yield key, self[key]
+
+    def items(self):
+        return list(self.iteritems())
+
+    def to_dict(self):
+        return dict(self.iteritems())
+
+
+def compact_events(events):
+    """Yields a CompactEvent for each event in |events|, sharing one
+    string table."""
+    interner = Interner()
+    for event in events:
+        yield CompactEvent(event, interner)
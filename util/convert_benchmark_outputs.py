@@ -1,25 +1,144 @@
+import argparse
+import functools
 import glob
+import gzip
+import hashlib
 import json
+import multiprocessing
 import os
 import sys
 
 from util.read_trace import read_trace
-from util.scoped_chdir import scoped_chdir
 
 
-def convert(directory):
-    """Convert all telemetry benchmark results in a given directory to JSON."""
+_COMPACT_SEPARATORS = (',', ':')
+
+# format -> (extension, json.dump keyword arguments)
+_OUTPUT_FORMATS = {
+    'pretty': ('.json', {'indent': 2}),
+    'compact': ('.json', {'separators': _COMPACT_SEPARATORS}),
+    'gzip': ('.json.gz', {'separators': _COMPACT_SEPARATORS}),
+}
+
+_CHECKS = ['mtime', 'hash']
+# Sidecar recording the format (and the source digest for the 'hash'
+# check) of an output, since 'pretty' and 'compact' share an extension.
+# Only written when a check is requested.
+_INFO_SUFFIX = '.convert-info'
+
+
+def _output_path(html, output_format):
+    extension, _ = _OUTPUT_FORMATS[output_format]
+    return os.path.splitext(html)[0] + extension
+
+
+def _file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_info(output):
+    try:
+        with open(output + _INFO_SUFFIX) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def _write_info(output, output_format, digest):
+    with open(output + _INFO_SUFFIX, 'w') as f:
+        json.dump({'format': output_format, 'sha1': digest}, f)
+
+
+def _is_up_to_date(html, output, output_format, check, digest):
+    if not check or not os.path.exists(output):
+        return False
+    info = _read_info(output)
+    if info.get('format') != output_format:
+        return False
+    if check == 'mtime':
+        return os.path.getmtime(output) >= os.path.getmtime(html)
+    return info.get('sha1') == digest
+
+
+def _write_trace(trace, output, output_format):
+    _, dump_args = _OUTPUT_FORMATS[output_format]
+    # Write to a temporary file first so that an interrupted run never
+    # leaves a truncated output which looks up to date.
+    tmp = output + '.tmp'
+    if output_format == 'gzip':
+        f = gzip.open(tmp, 'wb')
+    else:
+        f = open(tmp, 'w')
+    with f:
+        json.dump(trace, f, **dump_args)
+    os.rename(tmp, output)
+
+
+def convert_file(html, output_format='pretty', check=None, trace=None):
+    """Converts |html| and returns the output path, or None if skipped.
+
+    |trace| is the trace data of |html| if the caller has already read it.
+    """
+    output = _output_path(html, output_format)
+    digest = _file_digest(html) if check == 'hash' else None
+    if _is_up_to_date(html, output, output_format, check, digest):
+        return None
+    if trace is None:
+        trace = read_trace(html)
+    _write_trace(trace, output, output_format)
+    if check:
+        _write_info(output, output_format, digest)
+    elif os.path.exists(output + _INFO_SUFFIX):
+        # It no longer describes the output.
+        os.remove(output + _INFO_SUFFIX)
+    return output
+
+
+def convert(directory, jobs=1, output_format='pretty', check=None):
+    """Convert all telemetry benchmark results in a given directory to JSON.
+
+    |jobs| files are converted in parallel. When |check| is 'mtime' or
+    'hash', files whose output is up to date are skipped. Returns the list
+    of written paths.
+    """
     directory = os.path.abspath(directory)
-    with scoped_chdir(directory):
-        for html in glob.glob('*.html'):
-            trace = read_trace(html)
-            filename = os.path.splitext(html)[0] + '.json'
-            with open(filename, 'w') as f:
-                f.write(json.dumps(trace, indent=2))
+    htmls = glob.glob(os.path.join(directory, '*.html'))
+    convert_one = functools.partial(
+        convert_file, output_format=output_format, check=check)
+    if jobs <= 1:
+        outputs = map(convert_one, htmls)
+    else:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            outputs = list(pool.imap_unordered(convert_one, htmls))
+        finally:
+            pool.close()
+            pool.join()
+    return [output for output in outputs if output]
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('directory')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1,
+                        help='Number of worker processes.')
+    parser.add_argument('-f', '--format', dest='output_format',
+                        choices=sorted(_OUTPUT_FORMATS), default='pretty',
+                        help='Output format.')
+    parser.add_argument('--skip-up-to-date', dest='check', choices=_CHECKS,
+                        help='Skip files whose output is newer (mtime) or '
+                        'was converted from the same content (hash).')
+    return parser.parse_args(args)
 
 
 def main(args):
-    convert(args[0])
+    opts = parse_args(args)
+    convert(opts.directory, jobs=opts.jobs, output_format=opts.output_format,
+            check=opts.check)
 
 
 if __name__ == '__main__':
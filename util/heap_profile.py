@@ -0,0 +1,238 @@
+"""Aggregates heap profiler dumps (--enable-heap-profiling) of a trace.
+
+Stack frames and type names are read from the 'stackFrames' and
+'typeNames' metadata events of each process (or the top-level
+'stackFrames' of the trace), and heap entries from args.dumps.heaps of
+memory dumps. Frames are interned into parallel arrays of parent and
+name indexes so that per-site and per-type totals are array updates
+rather than dict-of-dict walks.
+
+Heap entries without a type are inclusive totals of allocations made
+under their backtrace; entries with a type and an empty backtrace are
+per-type totals.
+"""
+
+import argparse
+import array
+import heapq
+import sys
+
+from util.read_trace import read_trace
+from util.trace_events import Interner, split_trace
+
+
+_ROOT = -1
+
+
+class StackFrames(object):
+    """Frames of one process as a parent-pointer array."""
+
+    def __init__(self):
+        self._ids = {}
+        self.parents = array.array('i')
+        self.names = array.array('i')
+        self._name_strings = Interner()
+
+    def add(self, frames):
+        """Adds a {frame id: {'name': ..., 'parent': id}} dict."""
+        for frame_id, frame in frames.iteritems():
+            self._index(frame_id, frames)
+
+    def _index(self, frame_id, frames):
+        index = self._ids.get(frame_id)
+        if index is not None:
+            return index
+        # Walk up iteratively; stacks can be deeper than the recursion limit.
+        chain = []
+        while frame_id is not None and frame_id not in self._ids:
+            chain.append(frame_id)
+            frame_id = frames[frame_id].get('parent')
+        parent = self._ids[frame_id] if frame_id is not None else _ROOT
+        for frame_id in reversed(chain):
+            index = self._ids[frame_id] = len(self.parents)
+            self.parents.append(parent)
+            self.names.append(
+                self._name_strings.get(frames[frame_id]['name']))
+            parent = index
+        return parent
+
+    def index_of(self, frame_id):
+        if frame_id == '':
+            return _ROOT
+        return self._ids[frame_id]
+
+    def name(self, index):
+        return self._name_strings.keys[self.names[index]]
+
+    def stack(self, index):
+        """Returns frame names from the root down to frame |index|."""
+        names = []
+        while index != _ROOT:
+            names.append(self.name(index))
+            index = self.parents[index]
+        names.reverse()
+        return names
+
+    def __len__(self):
+        return len(self.parents)
+
+
+class HeapProfile(object):
+    """Per-site and per-type totals of one heap of one process dump."""
+
+    def __init__(self, frames, type_names, entries):
+        self.frames = frames
+        count = len(frames)
+        self.inclusive_size = array.array('d', [0.0]) * count
+        self.inclusive_count = array.array('d', [0.0]) * count
+        self.total_size = 0
+        self.total_count = 0
+        # type name -> [size, count]
+        self.types = {}
+        for entry in entries:
+            size = int(entry['size'], 16)
+            allocations = int(entry.get('count', '0'), 16)
+            backtrace = entry.get('bt', '')
+            type_id = entry.get('type')
+            if type_id is None:
+                index = frames.index_of(backtrace)
+                if index == _ROOT:
+                    self.total_size += size
+                    self.total_count += allocations
+                else:
+                    self.inclusive_size[index] += size
+                    self.inclusive_count[index] += allocations
+            elif backtrace == '':
+                name = type_names.get(type_id, type_id)
+                totals = self.types.setdefault(name, [0, 0])
+                totals[0] += size
+                totals[1] += allocations
+        self._compute_exclusive()
+
+    def _compute_exclusive(self):
+        # Allocations made directly in a frame are its inclusive total
+        # minus the inclusive totals of its callees.
+        self.exclusive_size = array.array('d', self.inclusive_size)
+        self.exclusive_count = array.array('d', self.inclusive_count)
+        parents = self.frames.parents
+        for index in xrange(len(parents)):
+            parent = parents[index]
+            if parent != _ROOT:
+                self.exclusive_size[parent] -= self.inclusive_size[index]
+                self.exclusive_count[parent] -= self.inclusive_count[index]
+
+    def top_sites(self, n=20):
+        """Returns the |n| allocation sites with the most bytes allocated
+        directly in them, as (stack, size, count) tuples."""
+        sizes = self.exclusive_size
+        indexes = heapq.nlargest(n, (i for i in xrange(len(sizes))
+                                     if sizes[i] > 0),
+                                 key=sizes.__getitem__)
+        return [(self.frames.stack(i), int(sizes[i]),
+                 int(self.exclusive_count[i])) for i in indexes]
+
+    def top_types(self, n=20):
+        """Returns the |n| types with most bytes as (name, size, count)."""
+        return heapq.nlargest(n, ((name, size, count) for name, (size, count)
+                                  in self.types.iteritems()),
+                              key=lambda item: item[1])
+
+    def bottom_up(self, max_depth=10, min_size=0):
+        """Returns a bottom-up tree of allocation sites.
+
+        The roots are the functions which allocate; the children of a node
+        are its callers. Frames with the same name at the same position
+        are merged. Each node is {'name', 'size', 'count', 'children'}.
+        """
+        root = {'name': '', 'size': 0, 'count': 0, 'children': {}}
+        parents = self.frames.parents
+        for index in xrange(len(parents)):
+            size = int(self.exclusive_size[index])
+            if size <= min_size:
+                continue
+            count = int(self.exclusive_count[index])
+            root['size'] += size
+            root['count'] += count
+            node = root
+            frame = index
+            depth = 0
+            while frame != _ROOT and depth < max_depth:
+                name = self.frames.name(frame)
+                child = node['children'].get(name)
+                if child is None:
+                    child = node['children'][name] = {
+                        'name': name, 'size': 0, 'count': 0, 'children': {}}
+                child['size'] += size
+                child['count'] += count
+                node = child
+                frame = parents[frame]
+                depth += 1
+        return _sorted_tree(root)
+
+
+def _sorted_tree(node):
+    children = sorted(node['children'].itervalues(),
+                      key=lambda child: child['size'], reverse=True)
+    node['children'] = [_sorted_tree(child) for child in children]
+    return node
+
+
+def iter_heap_profiles(trace_data):
+    """Yields (pid, ts, heap name, HeapProfile) for every heap dump in
+    |trace_data| (as returned by read_trace)."""
+    events, metadata = split_trace(trace_data)
+    global_frames = (metadata or {}).get('stackFrames', {})
+    frames = {}
+    type_names = {}
+    dumps = []
+    for event in events:
+        phase = event.get('ph')
+        pid = event.get('pid')
+        if phase == 'M' and event.get('name') == 'stackFrames':
+            frames.setdefault(pid, {}).update(event['args']['stackFrames'])
+        elif phase == 'M' and event.get('name') == 'typeNames':
+            type_names.setdefault(pid, {}).update(event['args']['typeNames'])
+        elif phase == 'v':
+            heaps = event.get('args', {}).get('dumps', {}).get('heaps')
+            if heaps:
+                dumps.append(event)
+    # Frames are interned once per process and shared by all its dumps.
+    interned = {}
+    for event in dumps:
+        pid = event['pid']
+        if pid not in interned:
+            interned[pid] = StackFrames()
+            interned[pid].add(frames.get(pid) or global_frames)
+        for heap_name, heap in event['args']['dumps']['heaps'].iteritems():
+            yield (pid, event['ts'], heap_name,
+                   HeapProfile(interned[pid], type_names.get(pid, {}),
+                               heap.get('entries', [])))
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('trace')
+    parser.add_argument('-n', '--top', dest='top', type=int, default=10,
+                        help='Number of sites and types to show.')
+    return parser.parse_args(args)
+
+
+def main(args):
+    opts = parse_args(args)
+    # Show the last dump of each process and heap.
+    last = {}
+    for pid, ts, heap_name, profile in iter_heap_profiles(
+            read_trace(opts.trace)):
+        last[(pid, heap_name)] = (ts, profile)
+    for (pid, heap_name), (ts, profile) in sorted(last.iteritems()):
+        print('[pid %s, %s at %s] %d bytes' % (pid, heap_name, ts,
+                                               profile.total_size))
+        for stack, size, count in profile.top_sites(opts.top):
+            print('  %10d %8d  %s' % (size, count, ' <- '.join(
+                reversed(stack[-3:]))))
+        for name, size, count in profile.top_types(opts.top):
+            print('  %10d %8d  (%s)' % (size, count, name))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
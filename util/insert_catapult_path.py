@@ -1,12 +1,26 @@
+"""Puts catapult (devil, perf_insights, telemetry, tracing) on sys.path.
+
+This is done when the module is first imported, so import it only right
+before importing catapult modules; tools which don't need catapult
+shouldn't need a Chromium checkout.
+"""
+
 import os
 import sys
 
 from util import get_chromium_path
 
-_chromium_path = get_chromium_path()
-_catapult_path = os.path.join(_chromium_path, 'third_party', 'catapult')
 
-sys.path.insert(0, os.path.join(_catapult_path, 'devil'))
-sys.path.insert(0, os.path.join(_catapult_path, 'perf_insights'))
-sys.path.insert(0, os.path.join(_catapult_path, 'telemetry'))
-sys.path.insert(0, os.path.join(_catapult_path, 'tracing'))
+_CATAPULT_PROJECTS = ['devil', 'perf_insights', 'telemetry', 'tracing']
+
+
+def _insert_paths():
+    catapult_path = os.path.join(get_chromium_path(), 'third_party',
+                                 'catapult')
+    for project in _CATAPULT_PROJECTS:
+        path = os.path.join(catapult_path, project)
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+
+_insert_paths()
@@ -0,0 +1,129 @@
+"""Memory-infra dumps of a whole trace as NumPy arrays.
+
+Every allocator attribute of every process memory dump is stored as one
+row of parallel arrays (dump, process, allocator path, attribute, value),
+so a time series or a dump x process matrix for any allocator is a
+vectorized selection rather than a Python loop over dumps.
+"""
+
+import numpy as np
+
+from util.trace_events import Interner
+
+
+_MAX_HEX_DIGITS = 16
+
+# ASCII code -> hex digit value; padding (NUL) maps to 0.
+_HEX_DIGITS = np.zeros(256, dtype=np.uint64)
+for _i, _c in enumerate('0123456789abcdef'):
+    _HEX_DIGITS[ord(_c)] = _i
+    _HEX_DIGITS[ord(_c.upper())] = _i
+
+
+def decode_hex(values):
+    """Decodes a sequence of hex strings into an int64 array in bulk."""
+    # One extra byte per value to detect values which are too long.
+    raw = np.array(values, dtype='S%d' % (_MAX_HEX_DIGITS + 1))
+    codes = raw.view(np.uint8).reshape(len(raw), _MAX_HEX_DIGITS + 1)
+    if codes[:, _MAX_HEX_DIGITS].any():
+        raise ValueError('Hex value does not fit in 64 bits')
+    codes = codes[:, :_MAX_HEX_DIGITS]
+    lengths = (codes != 0).sum(axis=1)
+    # Strings are left-aligned, so digit j has weight 16^(length - 1 - j).
+    shifts = (lengths[:, np.newaxis] - 1 -
+              np.arange(_MAX_HEX_DIGITS)[np.newaxis, :]) * 4
+    valid = shifts >= 0
+    digits = np.where(valid, _HEX_DIGITS[codes], 0).astype(np.uint64)
+    shifts = np.where(valid, shifts, 0).astype(np.uint64)
+    return (digits << shifts).sum(axis=1).astype(np.int64)
+
+
+class MemoryDumps(object):
+    """All allocator attributes of the memory dumps in trace |events|.
+
+    Dumps are ordered by time; |times| holds the earliest timestamp (in
+    trace microseconds) of each dump across processes. Only scalar
+    attributes named in |attrs| are kept.
+    """
+
+    def __init__(self, events, attrs=('size',)):
+        dumps = Interner()
+        pids = Interner()
+        paths = Interner()
+        attr_ids = {name: i for i, name in enumerate(attrs)}
+        dump_times = {}
+        columns = ([], [], [], [])
+        hex_values = []
+        for event in events:
+            if event.get('ph') != 'v':
+                continue
+            allocators = event.get('args', {}).get('dumps', {}).get(
+                'allocators')
+            if not allocators:
+                continue
+            dump_id = dumps.get(event.get('id', event['ts']))
+            dump_times[dump_id] = min(event['ts'],
+                                      dump_times.get(dump_id, event['ts']))
+            pid_id = pids.get(event['pid'])
+            for path, allocator in allocators.iteritems():
+                path_id = None
+                for attr_name, attr in allocator.get('attrs', {}).iteritems():
+                    attr_id = attr_ids.get(attr_name)
+                    if attr_id is None or attr.get('type') != 'scalar':
+                        continue
+                    if path_id is None:
+                        path_id = paths.get(path)
+                    columns[0].append(dump_id)
+                    columns[1].append(pid_id)
+                    columns[2].append(path_id)
+                    columns[3].append(attr_id)
+                    hex_values.append(attr['value'])
+
+        times = np.array([dump_times[i] for i in range(len(dumps.keys))],
+                         dtype=np.float64)
+        order = np.argsort(times, kind='mergesort')
+        # rank[old dump index] -> index in time order
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        self.times = times[order]
+        self.dump_ids = [dumps.keys[i] for i in order]
+        self.pids = np.array(pids.keys)
+        self.paths = paths.keys
+        self.attrs = list(attrs)
+        self._path_ids = paths.ids
+        self._pid_ids = pids.ids
+        self.dump = rank[np.array(columns[0], dtype=np.intp)]
+        self.process = np.array(columns[1], dtype=np.intp)
+        self.path = np.array(columns[2], dtype=np.intp)
+        self.attr = np.array(columns[3], dtype=np.intp)
+        self.values = decode_hex(hex_values)
+
+    def _select(self, path, attr):
+        path_id = self._path_ids.get(path)
+        if path_id is None:
+            return np.zeros(len(self.values), dtype=bool)
+        return (self.path == path_id) & (self.attr == self.attrs.index(attr))
+
+    def series(self, pid, path, attr='size'):
+        """Returns (times, values) of |path| in process |pid|."""
+        mask = self._select(path, attr)
+        pid_id = self._pid_ids.get(pid)
+        mask &= self.process == (-1 if pid_id is None else pid_id)
+        dump = self.dump[mask]
+        order = np.argsort(dump, kind='mergesort')
+        return self.times[dump[order]], self.values[mask][order]
+
+    def matrix(self, path, attr='size'):
+        """Returns a dumps x processes float array of |path|.
+
+        Columns follow |pids|; dumps without the allocator are NaN.
+        """
+        result = np.full((len(self.times), len(self.pids)), np.nan)
+        mask = self._select(path, attr)
+        result[self.dump[mask], self.process[mask]] = self.values[mask]
+        return result
+
+    def paths_under(self, prefix):
+        """Returns allocator paths equal to or below |prefix|."""
+        return [path for path in self.paths
+                if path == prefix or path.startswith(prefix + '/')]
@@ -0,0 +1,144 @@
+"""Downsampled per-process, per-allocator memory timelines.
+
+Long runs such as periodic_scroll or tbm_scroll soak traces contain many
+memory dumps. TimelineBuilder reduces them to at most |num_buckets|
+min/max/mean buckets per series while streaming, doubling the bucket
+width whenever the trace outgrows the current range, so memory only
+depends on the number of series and buckets.
+"""
+
+import argparse
+import json
+import sys
+
+from util.allocator_tree import build_allocator_tree
+from util.read_trace import iter_trace_events
+
+
+ALLOCATORS = ['partition_alloc', 'blink_gc', 'v8', 'skia', 'cc', 'malloc']
+
+# Indexes of a bucket list.
+_MIN, _MAX, _TOTAL, _COUNT = range(4)
+
+
+def _merge_buckets(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return [min(a[_MIN], b[_MIN]), max(a[_MAX], b[_MAX]),
+            a[_TOTAL] + b[_TOTAL], a[_COUNT] + b[_COUNT]]
+
+
+class TimelineBuilder(object):
+    """Builds downsampled timelines from memory dump events.
+
+    Events are expected in roughly increasing time order; dumps before
+    the first one seen go to the first bucket.
+    """
+
+    def __init__(self, num_buckets=100, allocators=ALLOCATORS,
+                 initial_bucket_width=1000.0):
+        if num_buckets < 2:
+            raise ValueError('num_buckets must be at least 2')
+        self._num_buckets = num_buckets
+        self._allocators = allocators
+        self._width = initial_bucket_width
+        self._start = None
+        # (pid, allocator) -> list of buckets (None for empty buckets)
+        self._series = {}
+        # pid -> name
+        self.process_names = {}
+
+    def _compact(self):
+        self._width *= 2
+        for key, buckets in self._series.iteritems():
+            self._series[key] = [
+                _merge_buckets(buckets[i],
+                               buckets[i + 1] if i + 1 < len(buckets) else None)
+                for i in range(0, len(buckets), 2)]
+
+    def _bucket_index(self, ts):
+        if self._start is None:
+            self._start = ts
+        while True:
+            index = int(max(ts - self._start, 0) // self._width)
+            if index < self._num_buckets:
+                return index
+            self._compact()
+
+    def add_event(self, event):
+        phase = event.get('ph')
+        if phase == 'M' and event.get('name') == 'process_name':
+            self.process_names[event['pid']] = event['args']['name']
+            return
+        if phase != 'v':
+            return
+        allocators = event.get('args', {}).get('dumps', {}).get('allocators')
+        if not allocators:
+            return
+        index = self._bucket_index(event['ts'])
+        # Some allocators such as malloc have their total on their own
+        # node, others only on descendants such as partition_alloc/
+        # partitions/*.
+        tree = build_allocator_tree(allocators)
+        for allocator in self._allocators:
+            node = tree.children.get(allocator)
+            value = node.aggregate('size') if node else None
+            if not value:
+                continue
+            buckets = self._series.setdefault((event['pid'], allocator), [])
+            if len(buckets) <= index:
+                buckets.extend([None] * (index + 1 - len(buckets)))
+            buckets[index] = _merge_buckets(
+                buckets[index], [value, value, value, 1])
+
+    def add_events(self, events):
+        for event in events:
+            self.add_event(event)
+
+    def timelines(self):
+        """Returns {pid: {allocator: series}}.
+
+        Each series has parallel 'times' (bucket start, in trace
+        microseconds), 'min', 'max' and 'mean' lists; empty buckets are
+        omitted.
+        """
+        result = {}
+        for (pid, allocator), buckets in self._series.iteritems():
+            series = {'times': [], 'min': [], 'max': [], 'mean': []}
+            for i, bucket in enumerate(buckets):
+                if bucket is None:
+                    continue
+                series['times'].append(self._start + i * self._width)
+                series['min'].append(bucket[_MIN])
+                series['max'].append(bucket[_MAX])
+                series['mean'].append(float(bucket[_TOTAL]) / bucket[_COUNT])
+            result.setdefault(pid, {})[allocator] = series
+        return result
+
+
+def build_timelines(filename, num_buckets=100):
+    builder = TimelineBuilder(num_buckets)
+    builder.add_events(iter_trace_events(filename))
+    return {
+        'process_names': builder.process_names,
+        'timelines': builder.timelines(),
+    }
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('trace')
+    parser.add_argument('-b', '--buckets', dest='buckets', type=int,
+                        default=100, help='Maximum number of buckets.')
+    return parser.parse_args(args)
+
+
+def main(args):
+    opts = parse_args(args)
+    print(json.dumps(build_timelines(opts.trace, opts.buckets), indent=2))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,11 +1,21 @@
 import base64
+import codecs
 import gzip
 import json
+import mmap
 import zlib
 import re
 import os
 import sys
 
+from util.compact_trace import compact_events
+
+
+_CHUNK_SIZE = 64 * 1024
+_WHITESPACE = ' \t\n\r'
+_VIEWER_DATA_BEGIN = b'<script id="viewer-data" type="application/json">\n'
+_VIEWER_DATA_END = b'\n</script>'
+
 
 def _get_viewer_data(html_contents):
     m = re.search(
@@ -14,29 +24,239 @@ def _get_viewer_data(html_contents):
     return m.group(1)
 
 
-def get_trace_data_from_html(html_contents):
+def _read_chunks(f, size=_CHUNK_SIZE):
+    while True:
+        chunk = f.read(size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _inflate_chunks(compressed_chunks):
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS|32)
+    for compressed in compressed_chunks:
+        raw_data = decompressor.decompress(compressed)
+        if raw_data:
+            yield raw_data
+    raw_data = decompressor.flush()
+    if raw_data:
+        yield raw_data
+
+
+def _b64decode_chunks(data, begin, end):
+    # _CHUNK_SIZE is a multiple of 4 so every slice decodes on its own.
+    for i in range(begin, end, _CHUNK_SIZE):
+        yield base64.b64decode(data[i:min(i + _CHUNK_SIZE, end)])
+
+
+def _locate_viewer_data(mapped):
+    """Returns the (begin, end) offsets of the viewer-data payload."""
+    begin = mapped.find(_VIEWER_DATA_BEGIN)
+    if begin < 0:
+        raise Exception('No viewer-data found')
+    begin += len(_VIEWER_DATA_BEGIN)
+    end = mapped.find(b'\n', begin)
+    if end < 0 or mapped.find(_VIEWER_DATA_END, end) != end:
+        raise Exception('Unterminated viewer-data')
+    return begin, end
+
+
+def _html_chunks(html_contents):
     viewer_data = _get_viewer_data(html_contents)
-    compressed = base64.b64decode(viewer_data)
-    raw_data = zlib.decompress(compressed, zlib.MAX_WBITS|32)
-    trace_data = json.loads(raw_data)
-    return trace_data
+    return _inflate_chunks(_b64decode_chunks(viewer_data, 0, len(viewer_data)))
+
+
+def _html_file_chunks(filename):
+    """Yields the decompressed trace embedded in a telemetry HTML file.
 
+    The file is memory-mapped, and the viewer-data payload is base64-decoded
+    and inflated a chunk at a time.
+    """
+    with open(filename, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            begin, end = _locate_viewer_data(mapped)
+            compressed_chunks = _b64decode_chunks(mapped, begin, end)
+            for chunk in _inflate_chunks(compressed_chunks):
+                yield chunk
+        finally:
+            mapped.close()
 
-def read_trace(filename):
+
+def _file_chunks(filename):
     _, ext = os.path.splitext(filename)
     if ext == '.json':
-        with open(filename) as f:
-            return json.load(f)
+        with open(filename, 'rb') as f:
+            for chunk in _read_chunks(f):
+                yield chunk
     elif ext == '.html':
-        with open(filename) as f:
-            return get_trace_data_from_html(f.read())
+        for chunk in _html_file_chunks(filename):
+            yield chunk
     elif ext == '.gz':
         with gzip.open(filename, 'rb') as f:
-            return json.load(f)
+            for chunk in _read_chunks(f):
+                yield chunk
     else:
         raise Exception('Unsupported format: ' + ext)
 
 
+class _JSONStream(object):
+    """Decodes JSON values one by one from an iterable of byte chunks.
+
+    Only the undecoded tail of the input is kept in memory.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = u''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self, size):
+        # Reads at least |size| more characters unless the input ends.
+        pending = [self._buffer[self._pos:]]
+        read = 0
+        while read < size and not self._eof:
+            try:
+                text = self._utf8.decode(next(self._chunks))
+            except StopIteration:
+                text = self._utf8.decode(b'', True)
+                self._eof = True
+            pending.append(text)
+            read += len(text)
+        self._buffer = u''.join(pending)
+        self._pos = 0
+        return read > 0
+
+    def peek(self):
+        """Returns the next non-whitespace character, or '' at the end."""
+        while True:
+            while (self._pos < len(self._buffer) and
+                   self._buffer[self._pos] in _WHITESPACE):
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill(1):
+                return ''
+
+    def skip(self, char):
+        if self.peek() != char:
+            raise ValueError('Expected %r but got %r' % (char, self.peek()))
+        self._pos += 1
+
+    def decode(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+                # A number may continue in the next chunk.
+                if end < len(self._buffer) or self._eof:
+                    self._pos = end
+                    return value
+            except ValueError:
+                if self._eof:
+                    raise
+            # Grow geometrically so huge values are decoded in linear time.
+            self._fill(max(_CHUNK_SIZE, len(self._buffer) - self._pos))
+
+
+class _TraceReader(object):
+    """Iterates over trace events in a JSON array or JSON object trace.
+
+    For the object form, top-level values other than traceEvents are stored
+    in |metadata| as they are encountered. |metadata| stays None for the
+    array form.
+    """
+
+    def __init__(self, chunks):
+        self._stream = _JSONStream(chunks)
+        self.metadata = None
+
+    def _iter_array(self):
+        stream = self._stream
+        stream.skip('[')
+        while True:
+            c = stream.peek()
+            # Chrome may leave the array unterminated.
+            if c == '':
+                return
+            if c == ']':
+                stream.skip(']')
+                return
+            if c == ',':
+                stream.skip(',')
+                continue
+            yield stream.decode()
+
+    def _iter_object(self):
+        stream = self._stream
+        stream.skip('{')
+        self.metadata = {}
+        while True:
+            c = stream.peek()
+            if c == '}' or c == '':
+                return
+            if c == ',':
+                stream.skip(',')
+                continue
+            key = stream.decode()
+            stream.skip(':')
+            if key == 'traceEvents' and stream.peek() == '[':
+                for event in self._iter_array():
+                    yield event
+            else:
+                self.metadata[key] = stream.decode()
+
+    def __iter__(self):
+        c = self._stream.peek()
+        if c == '[':
+            return self._iter_array()
+        elif c == '{':
+            return self._iter_object()
+        raise ValueError('Not a trace: unexpected %r' % c)
+
+
+def _collect(reader, compact=False):
+    events = list(compact_events(reader) if compact else reader)
+    if reader.metadata is None:
+        return events
+    trace_data = dict(reader.metadata)
+    trace_data['traceEvents'] = events
+    return trace_data
+
+
+def iter_trace_events(filename):
+    """Yields trace events in |filename| one at a time.
+
+    Supports .json, .json.gz and telemetry .html traces. The trace is
+    decompressed and parsed incrementally.
+    """
+    return iter(_TraceReader(_file_chunks(filename)))
+
+
+def iter_compressed_trace_events(compressed_chunks):
+    """Yields trace events from gzip or zlib compressed JSON chunks.
+
+    Useful to parse a trace while it is still being transferred.
+    """
+    return iter(_TraceReader(_inflate_chunks(compressed_chunks)))
+
+
+def get_trace_data_from_html(html_contents):
+    return _collect(_TraceReader(_html_chunks(html_contents)))
+
+
+def read_trace(filename, compact=False):
+    """Reads the whole trace in |filename|.
+
+    If |compact| is True, events are util.compact_trace.CompactEvents
+    instead of dicts, which take much less memory.
+    """
+    return _collect(_TraceReader(_file_chunks(filename)), compact)
+
+
 def main(args):
     trace_data = read_trace(args[0])
     print(json.dumps(trace_data, indent=2))
@@ -0,0 +1,132 @@
+"""Significance tests for comparing two sets of samples of a metric."""
+
+import math
+
+import numpy as np
+
+
+def mann_whitney(before, after):
+    """Two-sided Mann-Whitney U test with the normal approximation.
+
+    Ties get average ranks and the variance is tie-corrected. Returns
+    (u, p_value) where u is the statistic of |before|.
+    """
+    before = np.asarray(before, dtype=np.float64)
+    after = np.asarray(after, dtype=np.float64)
+    n1 = len(before)
+    n2 = len(after)
+    n = n1 + n2
+    _, inverse, counts = np.unique(np.concatenate([before, after]),
+                                   return_inverse=True, return_counts=True)
+    # Average 1-based rank of each distinct value.
+    average_ranks = np.cumsum(counts) - (counts - 1) / 2.0
+    u = average_ranks[inverse[:n1]].sum() - n1 * (n1 + 1) / 2.0
+    ties = (counts ** 3 - counts).sum()
+    variance = n1 * n2 / 12.0 * ((n + 1) - ties / float(n * (n - 1)))
+    if variance <= 0:
+        return u, 1.0
+    z = (abs(u - n1 * n2 / 2.0) - 0.5) / math.sqrt(variance)
+    return u, math.erfc(max(z, 0) / math.sqrt(2))
+
+
+def bootstrap_mean_difference(before, after, confidence=0.95,
+                              iterations=1000, seed=0):
+    """Bootstrap confidence interval of mean(after) - mean(before).
+
+    All resamples are drawn and averaged as matrices at once. Returns
+    (difference, low, high).
+    """
+    before = np.asarray(before, dtype=np.float64)
+    after = np.asarray(after, dtype=np.float64)
+    random = np.random.RandomState(seed)
+    before_means = before[random.randint(
+        0, len(before), (iterations, len(before)))].mean(axis=1)
+    after_means = after[random.randint(
+        0, len(after), (iterations, len(after)))].mean(axis=1)
+    tail = (1 - confidence) / 2 * 100
+    low, high = np.percentile(after_means - before_means,
+                              [tail, 100 - tail])
+    return after.mean() - before.mean(), low, high
+
+
+def normal_mean_difference(before, after, confidence=0.95):
+    """Welch (normal approximation) confidence interval of
+    mean(after) - mean(before). Returns (difference, low, high)."""
+    before = np.asarray(before, dtype=np.float64)
+    after = np.asarray(after, dtype=np.float64)
+    difference = after.mean() - before.mean()
+    stderr = math.sqrt(before.var(ddof=1) / len(before) +
+                       after.var(ddof=1) / len(after))
+    z = _normal_quantile(1 - (1 - confidence) / 2)
+    return difference, difference - z * stderr, difference + z * stderr
+
+
+def _normal_quantile(q):
+    # Bisection on erfc; precise enough for confidence levels.
+    low, high = -10.0, 10.0
+    for _ in range(100):
+        middle = (low + high) / 2
+        if 0.5 * math.erfc(-middle / math.sqrt(2)) < q:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2
+
+
+def benjamini_hochberg(p_values, alpha):
+    """Returns a bool array of which |p_values| are significant at false
+    discovery rate |alpha|."""
+    p_values = np.asarray(p_values, dtype=np.float64)
+    count = len(p_values)
+    significant = np.zeros(count, dtype=bool)
+    if not count:
+        return significant
+    order = np.argsort(p_values)
+    thresholds = alpha * np.arange(1, count + 1) / float(count)
+    passed = np.nonzero(p_values[order] <= thresholds)[0]
+    if len(passed):
+        significant[order[:passed[-1] + 1]] = True
+    return significant
+
+
+# Above this many samples per side the bootstrap interval is replaced by
+# the normal approximation, which it converges to, to keep large
+# comparisons fast.
+_MAX_BOOTSTRAP_SAMPLES = 200
+
+
+def compare(before, after, alpha=0.05, confidence=0.95, iterations=1000,
+            max_bootstrap_samples=_MAX_BOOTSTRAP_SAMPLES):
+    """Compares two {metric: samples} dicts.
+
+    Metrics present in both with at least two samples on each side are
+    tested. Returns a list of dicts sorted by p-value, each with
+    'significant' set according to the Benjamini-Hochberg procedure so
+    that testing hundreds of metrics doesn't produce false alarms.
+    """
+    results = []
+    for metric in sorted(set(before) & set(after)):
+        a = before[metric]
+        b = after[metric]
+        if len(a) < 2 or len(b) < 2:
+            continue
+        _, p_value = mann_whitney(a, b)
+        if max(len(a), len(b)) > max_bootstrap_samples:
+            difference, low, high = normal_mean_difference(
+                a, b, confidence=confidence)
+        else:
+            difference, low, high = bootstrap_mean_difference(
+                a, b, confidence=confidence, iterations=iterations)
+        results.append({
+            'metric': metric,
+            'before_mean': float(np.mean(a)),
+            'after_mean': float(np.mean(b)),
+            'difference': float(difference),
+            'ci_low': float(low),
+            'ci_high': float(high),
+            'p_value': p_value,
+        })
+    significant = benjamini_hochberg([r['p_value'] for r in results], alpha)
+    for result, is_significant in zip(results, significant):
+        result['significant'] = bool(is_significant)
+    return sorted(results, key=lambda r: r['p_value'])
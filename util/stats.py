@@ -0,0 +1,113 @@
+import math
+
+
+class RunningStats(object):
+    """Mean, variance, min and max of a stream of values in O(1) memory.
+
+    Uses Welford's method, which stays accurate for large values such as
+    byte counts. Two instances can be merged, e.g. across files or worker
+    processes.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.lowest = None
+        self.hiest = None
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        if self.lowest is None or self.lowest > value:
+            self.lowest = value
+        if self.hiest is None or self.hiest < value:
+            self.hiest = value
+
+    def merge(self, other):
+        if not other.count:
+            return
+        if not self.count:
+            self.count = other.count
+            self.mean = other.mean
+            self._m2 = other._m2
+            self.lowest = other.lowest
+            self.hiest = other.hiest
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self._m2 += other._m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.lowest = min(self.lowest, other.lowest)
+        self.hiest = max(self.hiest, other.hiest)
+
+    @property
+    def variance(self):
+        """Population variance."""
+        if not self.count:
+            return 0.0
+        return self._m2 / self.count
+
+
+class QuantileSketch(object):
+    """Mergeable streaming quantile estimator for non-negative values.
+
+    Values are counted in logarithmic buckets (as in DDSketch), so each
+    estimate is within |relative_accuracy| of a true sample value and memory
+    depends only on the range of values, not on how many were added.
+    """
+
+    def __init__(self, relative_accuracy=0.001):
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self._buckets = {}
+        self._zero_count = 0
+        self._lowest = None
+        self._hiest = None
+        self.count = 0
+
+    def add(self, value):
+        self.count += 1
+        if self._lowest is None or self._lowest > value:
+            self._lowest = value
+        if self._hiest is None or self._hiest < value:
+            self._hiest = value
+        if value <= 0:
+            self._zero_count += 1
+            return
+        key = int(math.ceil(math.log(value) / self._log_gamma))
+        self._buckets[key] = self._buckets.get(key, 0) + 1
+
+    def merge(self, other):
+        if self._gamma != other._gamma:
+            raise ValueError('Cannot merge sketches of different accuracy')
+        if not other.count:
+            return
+        if not self.count:
+            self._lowest = other._lowest
+            self._hiest = other._hiest
+        else:
+            self._lowest = min(self._lowest, other._lowest)
+            self._hiest = max(self._hiest, other._hiest)
+        self.count += other.count
+        self._zero_count += other._zero_count
+        for key, count in other._buckets.iteritems():
+            self._buckets[key] = self._buckets.get(key, 0) + count
+
+    def quantile(self, q):
+        """Returns the estimated |q| quantile as a float, or None if no
+        value was added."""
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self._zero_count
+        if seen > rank:
+            return float(self._lowest)
+        for key in sorted(self._buckets):
+            seen += self._buckets[key]
+            if seen > rank:
+                estimate = 2 * self._gamma ** key / (self._gamma + 1)
+                return float(min(max(estimate, self._lowest), self._hiest))
@@ -0,0 +1,298 @@
+"""Columnar binary cache for trace events.
+
+A cache file starts with a JSON header followed by one typed column per
+event field (ts, dur, pid, tid and interned name/cat/ph ids) and the
+prebuilt pid and name indexes. Any other event fields, including args,
+are stored as compact JSON in a sidecar file and decoded only on demand.
+Columns are read lazily from a memory map, so reopening a cached trace
+only costs the header.
+"""
+
+import array
+import json
+import mmap
+import os
+import struct
+import sys
+
+from util.read_trace import read_trace
+from util.trace_events import Interner, split_trace
+
+
+_MAGIC = b'TRACECACHE2\n'
+_HEADER_LENGTH = struct.Struct('<I')
+_ALIGNMENT = 8
+_CACHE_SUFFIX = '.tcache'
+_ARGS_SUFFIX = '.args'
+
+# Bits of the 'present' column; a bit is set when the field is stored in
+# its column rather than in the sidecar.
+_FLOAT_FIELDS = [('ts', 1 << 0), ('dur', 1 << 1)]
+_INT_FIELDS = [('pid', 1 << 2), ('tid', 1 << 3)]
+_STRING_FIELDS = [('name', 1 << 4), ('cat', 1 << 5), ('ph', 1 << 6)]
+# Set when a float column holds an integer, which event() converts back.
+_INTEGRAL_BITS = {'ts': 1 << 7, 'dur': 1 << 8}
+# Integers above this aren't exact as doubles and stay in the sidecar.
+_MAX_EXACT_INT = 2 ** 53
+
+# column name -> array typecode
+_COLUMN_TYPES = {
+    'ts': 'd',
+    'dur': 'd',
+    'pid': 'l',
+    'tid': 'l',
+    'name': 'i',
+    'cat': 'i',
+    'ph': 'i',
+    'present': 'H',
+    'args_end': 'L',
+    'pid_order': 'L',
+    'name_order': 'L',
+}
+
+
+def _is_int(value):
+    return isinstance(value, (int, long)) and not isinstance(value, bool)
+
+
+def _is_float(value):
+    if _is_int(value):
+        return abs(value) <= _MAX_EXACT_INT
+    return isinstance(value, float)
+
+
+def _build_index(keys, present, bit):
+    """Groups indices of the events which have |bit| set by key.
+
+    Returns (order, index) where index maps each key to a (start, count)
+    range of the order column.
+    """
+    groups = {}
+    for i in xrange(len(present)):
+        if present[i] & bit:
+            groups.setdefault(keys[i], []).append(i)
+    order = array.array(_COLUMN_TYPES['pid_order'])
+    index = []
+    for key in sorted(groups):
+        index.append([key, len(order), len(groups[key])])
+        order.extend(groups[key])
+    return order, index
+
+
+def build_trace_cache(trace_data, path, source=None):
+    """Writes |trace_data| (as returned by read_trace) to a cache at |path|.
+
+    If |source| is given, its size and mtime are recorded so that
+    open_trace_cache() can detect stale caches.
+    """
+    events, metadata = split_trace(trace_data)
+    columns = {name: array.array(typecode)
+               for name, typecode in _COLUMN_TYPES.iteritems()}
+    strings = Interner()
+    args_end = 0
+    with open(path + _ARGS_SUFFIX, 'wb') as args_file:
+        for event in events:
+            rest = dict(event)
+            present = 0
+            for field, bit in _FLOAT_FIELDS:
+                value = rest.get(field)
+                if _is_float(value):
+                    del rest[field]
+                    present |= bit
+                    if _is_int(value):
+                        present |= _INTEGRAL_BITS[field]
+                columns[field].append(value if present & bit else 0.0)
+            for field, bit in _INT_FIELDS:
+                value = rest.get(field)
+                if _is_int(value):
+                    del rest[field]
+                    present |= bit
+                columns[field].append(value if present & bit else 0)
+            for field, bit in _STRING_FIELDS:
+                value = rest.get(field)
+                string_id = -1
+                if isinstance(value, basestring):
+                    del rest[field]
+                    present |= bit
+                    string_id = strings.get(value)
+                columns[field].append(string_id)
+            columns['present'].append(present)
+            if rest:
+                encoded = json.dumps(rest, separators=(',', ':'))
+                args_file.write(encoded)
+                args_end += len(encoded)
+            columns['args_end'].append(args_end)
+
+    count = len(columns['present'])
+    # Events without an int pid or a string name aren't indexed.
+    columns['pid_order'], pid_index = _build_index(
+        columns['pid'], columns['present'], dict(_INT_FIELDS)['pid'])
+    columns['name_order'], name_index = _build_index(
+        columns['name'], columns['present'], dict(_STRING_FIELDS)['name'])
+
+    layout = {}
+    offset = 0
+    for name in sorted(columns):
+        column = columns[name]
+        nbytes = len(column) * column.itemsize
+        layout[name] = [column.typecode, column.itemsize, offset, nbytes]
+        offset += (nbytes + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+    header = {
+        'count': count,
+        'columns': layout,
+        'strings': strings.keys,
+        'metadata': metadata,
+        'pid_index': pid_index,
+        'name_index': name_index,
+        'source': _source_stamp(source) if source else None,
+    }
+    encoded_header = json.dumps(header, separators=(',', ':'))
+    data_start = len(_MAGIC) + _HEADER_LENGTH.size + len(encoded_header)
+    padding = -data_start % _ALIGNMENT
+    with open(path, 'wb') as f:
+        f.write(_MAGIC)
+        f.write(_HEADER_LENGTH.pack(len(encoded_header) + padding))
+        f.write(encoded_header + b' ' * padding)
+        for name in sorted(columns):
+            nbytes = layout[name][3]
+            f.write(columns[name].tostring())
+            f.write(b'\0' * (-nbytes % _ALIGNMENT))
+
+
+def _source_stamp(source):
+    stat = os.stat(source)
+    return [stat.st_size, stat.st_mtime]
+
+
+class TraceCache(object):
+    """Read-only view of a trace cache written by build_trace_cache()."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(path + _ARGS_SUFFIX, 'rb') as f:
+            if os.fstat(f.fileno()).st_size:
+                self._args = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._args = b''
+        if self._mapped[:len(_MAGIC)] != _MAGIC:
+            raise Exception('Not a trace cache: ' + path)
+        start = len(_MAGIC)
+        header_length, = _HEADER_LENGTH.unpack_from(self._mapped, start)
+        start += _HEADER_LENGTH.size
+        header = json.loads(self._mapped[start:start + header_length])
+        self._data_start = start + header_length
+        self._count = header['count']
+        self._layout = header['columns']
+        self._columns = {}
+        self.strings = header['strings']
+        self._string_ids = {s: i for i, s in enumerate(self.strings)}
+        self.metadata = header['metadata']
+        self.source = header['source']
+        self._pid_index = {key: (start, count)
+                           for key, start, count in header['pid_index']}
+        self._name_index = {key: (start, count)
+                            for key, start, count in header['name_index']}
+
+    def close(self):
+        self._mapped.close()
+        if self._args:
+            self._args.close()
+
+    def __len__(self):
+        return self._count
+
+    def column(self, name):
+        """Returns the array of column |name|, reading it on first use."""
+        column = self._columns.get(name)
+        if column is None:
+            typecode, itemsize, offset, nbytes = self._layout[name]
+            column = array.array(typecode)
+            if column.itemsize != itemsize:
+                raise Exception('Trace cache was written on another platform')
+            start = self._data_start + offset
+            column.fromstring(self._mapped[start:start + nbytes])
+            self._columns[name] = column
+        return column
+
+    def _lookup(self, index, order_name, key):
+        start, count = index.get(key, (0, 0))
+        return self.column(order_name)[start:start + count]
+
+    def pids(self):
+        return sorted(self._pid_index)
+
+    def indices_for_pid(self, pid):
+        """Returns indices of events of |pid| in trace order."""
+        return self._lookup(self._pid_index, 'pid_order', pid)
+
+    def indices_for_name(self, name):
+        """Returns indices of events named |name| in trace order."""
+        string_id = self._string_ids.get(name)
+        if string_id is None:
+            return array.array(_COLUMN_TYPES['name_order'])
+        return self._lookup(self._name_index, 'name_order', string_id)
+
+    def args(self, i):
+        """Returns the sidecar fields of event |i|, including 'args'."""
+        ends = self.column('args_end')
+        start = ends[i - 1] if i > 0 else 0
+        if start == ends[i]:
+            return {}
+        return json.loads(self._args[start:ends[i]])
+
+    def event(self, i):
+        """Reconstructs event |i| as a dict."""
+        event = self.args(i)
+        present = self.column('present')[i]
+        for field, bit in _FLOAT_FIELDS:
+            if present & bit:
+                value = self.column(field)[i]
+                if present & _INTEGRAL_BITS[field]:
+                    value = int(value)
+                event[field] = value
+        for field, bit in _INT_FIELDS:
+            if present & bit:
+                event[field] = self.column(field)[i]
+        for field, bit in _STRING_FIELDS:
+            if present & bit:
+                event[field] = self.strings[self.column(field)[i]]
+        return event
+
+    def __iter__(self):
+        for i in xrange(self._count):
+            yield self.event(i)
+
+
+def _has_current_format(path):
+    with open(path, 'rb') as f:
+        return f.read(len(_MAGIC)) == _MAGIC
+
+
+def open_trace_cache(filename):
+    """Returns a TraceCache for |filename|, building it if needed.
+
+    The cache is stored next to the trace and rebuilt when the trace's
+    size or mtime changes, or when it was written in an older format.
+    """
+    path = filename + _CACHE_SUFFIX
+    if (os.path.exists(path) and os.path.exists(path + _ARGS_SUFFIX) and
+            _has_current_format(path)):
+        cache = TraceCache(path)
+        if cache.source == _source_stamp(filename):
+            return cache
+        cache.close()
+    build_trace_cache(read_trace(filename), path, source=filename)
+    return TraceCache(path)
+
+
+def main(args):
+    for filename in args:
+        cache = open_trace_cache(filename)
+        print('%s: %d events, %d pids, %d strings' % (
+            filename, len(cache), len(cache.pids()), len(cache.strings)))
+        cache.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
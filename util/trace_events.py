@@ -0,0 +1,43 @@
+"""Helpers shared by the modules which walk trace events."""
+
+
+def add_process_labels(labels, value):
+    """Adds the comma separated |value| of a process_labels metadata event
+    to |labels|, skipping labels already there as the trace model does."""
+    for label in value.split(','):
+        if label not in labels:
+            labels.append(label)
+
+
+def split_trace(trace_data):
+    """Returns (events, metadata) of |trace_data| as returned by read_trace.
+
+    metadata holds the fields other than 'traceEvents' of an object-form
+    trace, or is None for an array-form trace or any other iterable of
+    events.
+    """
+    if isinstance(trace_data, dict):
+        metadata = dict(trace_data)
+        return metadata.pop('traceEvents', []), metadata
+    return trace_data, None
+
+
+class Interner(object):
+    """Assigns consecutive ids to distinct keys."""
+
+    def __init__(self):
+        self.ids = {}
+        self.keys = []
+
+    def get(self, key):
+        """Returns the id of |key|, assigning the next one if it is new."""
+        key_id = self.ids.get(key)
+        if key_id is None:
+            key_id = self.ids[key] = len(self.keys)
+            self.keys.append(key)
+        return key_id
+
+    def canonical(self, key):
+        """Returns the first key seen which equals |key|, so that equal
+        strings share one object."""
+        return self.keys[self.get(key)]
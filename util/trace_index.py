@@ -0,0 +1,58 @@
+from util.trace_events import add_process_labels, split_trace
+
+
+class TraceIndex(object):
+    """Trace events hashed by name, pid, (pid, name) and phase.
+
+    Built in one pass over |trace_data|, which is either what read_trace
+    returns or any iterable of events. Process names and labels from
+    metadata events are resolved while indexing.
+    """
+
+    def __init__(self, trace_data):
+        self.events = []
+        self._by_name = {}
+        self._by_pid = {}
+        self._by_pid_and_name = {}
+        self._by_phase = {}
+        # pid -> name
+        self.process_names = {}
+        # pid -> list of labels
+        self.process_labels = {}
+        events, _ = split_trace(trace_data)
+        for event in events:
+            self._add(event)
+
+    def _add(self, event):
+        self.events.append(event)
+        name = event.get('name')
+        pid = event.get('pid')
+        phase = event.get('ph')
+        self._by_name.setdefault(name, []).append(event)
+        self._by_pid.setdefault(pid, []).append(event)
+        self._by_pid_and_name.setdefault((pid, name), []).append(event)
+        self._by_phase.setdefault(phase, []).append(event)
+        if phase != 'M':
+            return
+        if name == 'process_name':
+            self.process_names[pid] = event['args']['name']
+        elif name == 'process_labels':
+            add_process_labels(self.process_labels.setdefault(pid, []),
+                               event['args']['labels'])
+
+    def by_name(self, name):
+        return self._by_name.get(name, [])
+
+    def by_pid(self, pid):
+        return self._by_pid.get(pid, [])
+
+    def by_pid_and_name(self, pid, name):
+        return self._by_pid_and_name.get((pid, name), [])
+
+    def by_phase(self, phase):
+        return self._by_phase.get(phase, [])
+
+    def pids_of(self, process_name):
+        """Returns pids of processes named |process_name|, e.g. 'Renderer'."""
+        return sorted(pid for pid, name in self.process_names.iteritems()
+                      if name == process_name)